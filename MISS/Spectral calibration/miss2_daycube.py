@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Convert a day of MISS2 images into a smile-corrected spectral cube
+
+The result is a (time, zenith angle, wavelength) float32 array stored as
+a NumPy .npy-file, which can be memory-mapped with
+np.load(cubefile, mmap_mode='r'). The frame times and wavelengths are
+stored beside it. The images are processed in chunks so that the memory
+use stays small regardless of the number of images. If the conversion
+is interrupted, running it again continues from the last stored chunk.
+
+Frames that cannot be read (or have the wrong size) are stored as NaN.
+
+"""
+import datetime as dt
+import json
+import os
+import sys
+from os.path import isfile, join
+
+import numpy as np
+
+from miss2_spectral import miss2calibration, wavelengths
+
+sys.path.append(join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from miss_cube import day_frames, INSTRUMENTS
+
+
+def daycube_filenames(outpath, myday):
+    """
+    Names of the spectral cube, the frame times, the wavelengths and the
+    progress file for one day
+    """
+    name=join(outpath,f"MISS2-spectral-{myday.strftime('%Y%m%d')}")
+    return name+'.npy', name+'-times.npy', name+'-wavelengths.npy', name+'-progress.json'
+
+
+def _saveprogress(progressfile, progress):
+    tmpfile=progressfile+'.tmp'
+    with open(tmpfile,'w') as f:
+        json.dump(progress,f)
+    os.replace(tmpfile,progressfile)
+
+
+def miss2daycube(basepath, myday, outpath, cubepath=None, chunksize=60, overWrite=False):
+    """
+    Convert all MISS2 images of one day into a spectral cube in outpath.
+    The images are read from the day directory under basepath, or from
+    the night cube if cubepath is given and there is one (see miss_cube.py).
+
+    Returns the name of the spectral cube or None if there is no data.
+    """
+    cubefile, timesfile, wavesfile, progressfile=daycube_filenames(outpath,myday)
+    if overWrite==False and isfile(cubefile) and not isfile(progressfile):
+        print(f"Skipping existing {cubefile}")
+        return cubefile
+
+    myframes=sorted(day_frames(basepath, myday, 'MISS2', cubepath), key=lambda frame: frame[0])
+    if len(myframes)==0:
+        print("No data for ",myday)
+        return None
+
+    calibration=miss2calibration()
+    shape=(len(myframes), len(calibration.rows), len(wavelengths))
+    names=[thisbasename for filetime, thisbasename, loadframe in myframes]
+
+    # Continue an interrupted conversion if it was for the same set of images
+    done=0
+    tmpfile=cubefile+'.part'
+    if overWrite==False and isfile(progressfile) and isfile(tmpfile):
+        with open(progressfile) as f:
+            progress=json.load(f)
+        if progress['names']==names:
+            done=progress['done']
+            print(f'Continuing {cubefile} from frame {done}')
+
+    if done==0:
+        os.makedirs(outpath, exist_ok=True)
+        np.save(timesfile, np.array([filetime for filetime, thisbasename, loadframe in myframes],
+                                    dtype='datetime64[s]'))
+        np.save(wavesfile, wavelengths)
+        cube=np.lib.format.open_memmap(tmpfile, mode='w+', dtype=np.float32, shape=shape)
+        progress={'names': names, 'done': 0}
+        _saveprogress(progressfile, progress)
+    else:
+        cube=np.load(tmpfile, mmap_mode='r+')
+
+    # Process the images a chunk at a time: decode, correct the whole
+    # chunk at once and write it to the cube
+    for start in range(done, len(myframes), chunksize):
+        chunk=myframes[start:start+chunksize]
+        images=np.zeros((len(chunk),)+INSTRUMENTS['MISS2'][3], dtype=np.uint16)
+        usable=np.zeros(len(chunk), dtype=bool)
+
+        for i, (filetime, thisbasename, loadframe) in enumerate(chunk):
+            try:
+                thisimage=loadframe()
+            except Exception as error:
+                print('Could not process', thisbasename)
+                print(error)
+                continue
+            if thisimage.shape!=images.shape[1:]:
+                print(f'Ignoring {thisbasename} with frame size {thisimage.shape}')
+                continue
+            images[i]=thisimage
+            usable[i]=True
+
+        spectra=calibration.apply(images).astype(np.float32)
+        spectra[~usable]=np.nan
+        cube[start:start+len(chunk)]=spectra
+        cube.flush()
+
+        progress['done']=start+len(chunk)
+        _saveprogress(progressfile, progress)
+        print(f'     {chunk[-1][1]} {progress["done"]}/{len(myframes)}')
+
+    del cube
+    os.replace(tmpfile, cubefile)
+    os.remove(progressfile)
+    print(f'Stored {cubefile}')
+    return cubefile
+
+
+#======================================================================
+
+if __name__ == "__main__":
+    basepath=join('d:\\',"KHO","MISS-2")
+    cubepath=join(basepath,"Cubes")
+    outpath=join(basepath,"Spectral")
+
+    myday=dt.date(2025,11,13)
+    cubefile=miss2daycube(basepath, myday, outpath, cubepath)
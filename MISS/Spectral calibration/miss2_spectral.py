@@ -9,7 +9,7 @@ Mikko Syrjäsuo/UNIS, 2025-11-16
 
 """
 from datetime import datetime
-from os.path import isfile, join, basename
+from os.path import isfile, join, basename, dirname, abspath
 from glob import glob # It might be better to get an iterator?
 
 import numpy as np
@@ -20,59 +20,69 @@ from matplotlib import transforms
 from scipy import signal
 from PIL import Image
 
-def miss2spectral(missFile):
-    """
-    The estimated "smiley", see miss2_calibration.py
-    Note that, in the first setup, the polynomials
-    were estimated using only three auroral emission lines.
-    The most serious issue is the lack of a reference in
-    the blue end of the spectrum.
-    TO DO: use data where the auroral blue emission line is
-           also visible
-    """
-    p_blue=np.poly1d([-0.0004351,0.1633,68.56])
-    p_green=np.poly1d([-0.0003996, 0.1461,544])
-    p_red=np.poly1d([-0.0003619, 0.1322,797.1])
-    p_red2=np.poly1d([-0.0003952, 0.1534,816.3])
+from smile_correction import SmileCorrection
+
+"""
+The estimated "smiley", see miss2_calibration.py
+Note that, in the first setup, the polynomials
+were estimated using only three auroral emission lines.
+The most serious issue is the lack of a reference in
+the blue end of the spectrum.
+TO DO: use data where the auroral blue emission line is
+       also visible
+"""
+p_blue=np.poly1d([-0.0004351,0.1633,68.56])
+p_green=np.poly1d([-0.0003996, 0.1461,544])
+p_red=np.poly1d([-0.0003619, 0.1322,797.1])
+p_red2=np.poly1d([-0.0003952, 0.1534,816.3])
+linewaves=[427.8, 557.7, 630.0, 636.4]
+
+"""
+Based on the testplots, the wavelength range roughly 
+from 398nm to 697nm, so let's use 400 to 690nm as the 
+range to be interpolated from the spectral image. 
+In other words, the "scan angle" or zenith angle from north
+to south is roughly from row 70 to 270, which results in
+roughly one degree resolution along the meridian.
+"""
+wavelengths=np.arange(400,691)
+
+# The computed correction tables are stored here and reused by later runs
+# (set to None to always compute them)
+cachedir=join(dirname(abspath(__file__)),'cache')
+
+_calibration=None
 
+def miss2calibration():
     """
-    Based on the testplots, the wavelength range roughly 
-    from 398nm to 697nm, so let's use 400 to 690nm as the 
-    range to be interpolated from the spectral image. 
-    In other words, the "scan angle" or zenith angle from north
-    to south is roughly from row 70 to 270.
+    The smile correction for MISS2 images, computed on first use
     """
+    global _calibration
+    if _calibration is None:
+        _calibration=SmileCorrection([p_blue, p_green, p_red, p_red2], linewaves,
+                                     wavelengths, ncols=1039, firstrow=70, nrows=200,
+                                     cachedir=cachedir)
+    return _calibration
 
-    missImage=np.array(Image.open(missFile))
-    imsize=np.shape(missImage)
-    im=np.fliplr(np.rot90(missImage))
 
+def miss2spectral(missFile):
     """
-    Create a spectral image where each column represents a constant wavelength
-    - use data between 70 to 270 rows for the zenith angle, which
-      results in roughly one degree resolution along the meridian
-    - interpolate new datapoints for a range 400-690nm
+    Read a MISS2 png-file and remove the "smiley". Instead of a file name,
+    one can also give a frame or a stack of frames (time, rows, cols)
+    sliced from a night cube (see miss_cube.py).
+
+    Returns a spectral image (or a stack of them) where each column
+    represents a constant wavelength, and the wavelengths.
     """
 
-    scanangle=np.arange(0,200) # 270-70=200
-    wavelengths=np.arange(400,691)
-    spectralImage=np.zeros([len(scanangle),len(wavelengths)])
-    colIndex=np.arange(0,im.shape[1])
-
-    for alpha in scanangle:
-        row=70+alpha
-        blueline=p_blue(row)
-        greenline=p_green(row)
-        redline=p_red(row)
-        red2line=p_red2(row)
-
-        waves=np.polynomial.Polynomial.fit([427.8, 557.7, 630.0, 636.4], 
-                                           [blueline, greenline,redline,red2line],2)
-
-        cols=waves(wavelengths) # Pixel columns corresponding to wavelengths
-        thisrowvalues=im[row,:]
-        spectralValues=np.interp(cols, colIndex, thisrowvalues)
-        spectralImage[alpha,:]=spectralValues
+    # A frame sliced from a night cube is already flipped and rotated
+    if isinstance(missFile, np.ndarray):
+        im=missFile
+    else:
+        missImage=np.array(Image.open(missFile))
+        im=np.fliplr(np.rot90(missImage))
+
+    spectralImage=miss2calibration().apply(im)
     return spectralImage, wavelengths
 
 
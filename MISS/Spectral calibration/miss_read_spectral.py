@@ -24,39 +24,53 @@ Created on Fri May 10 13:30:25 2024
 """
 
 import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
-#=================================================================
-# A user called Felix wrote a nice short reading routine for ASCII PGM-files
-# https://stackoverflow.com/questions/46944048/how-to-read-pgm-p2-image-in-python
-#
-# The commonly used PIL for image reading in python seems to have trouble
+# The PGM reader is shared with the other MISS scripts in the parent
+# directory. The commonly used PIL for image reading seems to have trouble
 # handling the comments in PGM-files, even though the comments are part
 # of the "standard" for PNM-format.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from miss_io import readpgm
+from smile_correction import SmileCorrection
 
-def readpgm(name):
-    with open(name) as f:
-        lines = f.readlines()
 
-    # Ignores commented lines
-    for l in list(lines):
-        if l[0] == '#':
-            lines.remove(l)
+#=================================================================
+# From quick calibration using auroral emission lines,
+# see plot_misspeaks.m in the Matlab source code
 
-    # Makes sure it is ASCII format (P2)
-    assert lines[0].strip() == 'P2', 'File not an ASCII PGM-file'
+bluepoly=np.poly1d([-0.000401186790506, 0.118021155830754,
+                    86.670020639834831]);
+redpoly=np.poly1d([-0.0003147574819, 0.1045665634675,
+                        656.6050051599582]);
+greenpoly=np.poly1d([-0.0003805469556, 0.1139447884417,
+                     462.5405056759545]);
+linewaves=[427.8, 557.7, 630.0]
 
-    # Converts data to a list of integers
-    data = []
-    for line in lines[1:]:
-        data.extend([int(c) for c in line.split()])
+# Create a spectral image
+# - use data between rows 70 and 270 (needs scan angle calibration!)
+# - interpolate data from 400..700nm
 
-    data=(np.array(data[3:]),(data[1],data[0]),data[2])
-    return np.reshape(data[0],data[1])
+wavelengths=np.arange(400,701)
 
+# The computed correction tables are stored here and reused by later runs
+# (set to None to always compute them)
+cachedir=os.path.join(os.path.dirname(os.path.abspath(__file__)),'cache')
 
-#=================================================================
+# The corrections are computed once for each image width
+_calibrations={}
+
+def misscalibration(ncols):
+    """
+    The smile correction for MISS images with ncols columns
+    """
+    if ncols not in _calibrations:
+        _calibrations[ncols]=SmileCorrection([bluepoly, greenpoly, redpoly], linewaves,
+                                             wavelengths, ncols, firstrow=70, nrows=200,
+                                             cachedir=cachedir)
+    return _calibrations[ncols]
 
 
 def read_miss_spectral(filename):
@@ -68,37 +82,7 @@ def read_miss_spectral(filename):
     bg_estimate=np.mean(im[0:29,0:29])
     im=np.maximum(im-bg_estimate,0).transpose()
 
-
-    # From quick calibration using auroral emission lines,
-    # see plot_misspeaks.m in the Matlab source code
-
-    bluepoly=np.poly1d([-0.000401186790506, 0.118021155830754,
-                        86.670020639834831]);
-    redpoly=np.poly1d([-0.0003147574819, 0.1045665634675,
-                            656.6050051599582]);
-    greenpoly=np.poly1d([-0.0003805469556, 0.1139447884417,
-                         462.5405056759545]);
-
-    # Create a spectral image
-    # - use data between rows 70 and 270 (needs scan angle calibration!)
-    # - interpolate data from 400..700nm
-
-    scanangle=np.arange(0,200)
-    wavelengths=np.arange(400,701)
-    spectralimage=np.zeros([len(scanangle),len(wavelengths)])
-    colIndex=np.arange(0,im.shape[1])
-
-    for alpha in scanangle:
-        row=70+alpha
-        blueline=bluepoly(row)      # Locations of the auroral emission lines
-        redline=redpoly(row)        # at this scan angle, or image row in raw
-        greenline=greenpoly(row)    # image data
-        lambdas=np.polynomial.Polynomial.fit([427.8, 557.7, 630.0],
-                                             [blueline, greenline, redline],2)
-        cols=lambdas(wavelengths)
-        thisrowvalues=im[row,:]
-        spectralvalues=np.interp(cols,colIndex,thisrowvalues)
-        spectralimage[alpha,:]=spectralvalues
+    spectralimage=misscalibration(im.shape[1]).apply(im)
 
     return spectralimage
 
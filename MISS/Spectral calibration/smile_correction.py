@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed "smiley" correction for MISS spectral images
+
+The calibration polynomials (see miss2_calibration.py) give the pixel
+column of each emission line as a function of the image row. For each
+row, a 2nd degree polynomial through the emission lines maps wavelengths
+to pixel columns and the spectral image is interpolated from those
+columns.
+
+As the polynomials are constants, the mapping from (row, wavelength) to
+the source pixels and the interpolation weights only need to be computed
+once. After that, correcting a single image or a whole stack of images is
+a single gather and a multiply-add. The tables can also be stored in a
+cache directory, keyed by a hash of the calibration parameters, so that
+short-lived processes simply memory-map the tables computed earlier.
+
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+
+class SmileCorrection:
+    """
+    Mapping from a raw (flipped and rotated) MISS image to a spectral image,
+    where each column represents a constant wavelength and each row a scan
+    angle (rows firstrow..firstrow+nrows-1 of the raw image).
+    """
+
+    def __init__(self, linepolys, linewaves, wavelengths, ncols, firstrow=70, nrows=200,
+                 cachedir=None):
+        """
+        linepolys   - np.poly1d for each emission line, giving the pixel column
+                      of the line for an image row
+        linewaves   - wavelengths of the emission lines (nm)
+        wavelengths - wavelengths of the spectral image columns (nm)
+        ncols       - number of columns in the raw image
+        cachedir    - optional directory for storing the computed tables, which
+                      are then memory-mapped by later runs
+        """
+        self.wavelengths=np.asarray(wavelengths)
+        self.ncols=ncols
+        self.rows=firstrow+np.arange(nrows)
+
+        tables=None
+        if cachedir is not None:
+            key=calibration_key(linepolys, linewaves, self.wavelengths, ncols, firstrow, nrows)
+            tables=load_tables(cachedir, key)
+
+        if tables is None:
+            tables=remap_tables(linepolys, linewaves, self.wavelengths, ncols, self.rows)
+            if cachedir is not None:
+                save_tables(cachedir, key, tables)
+
+        self.left, self.right, self.weight=tables
+
+    def apply(self, images):
+        """
+        Correct one image (rows, cols) or a stack of images (n, rows, cols).
+        Returns a float64 array of shape (nrows, nwaves) or (n, nrows, nwaves).
+        """
+        images=np.asarray(images)
+        if images.shape[-1]!=self.ncols or images.shape[-2]<=self.rows[-1]:
+            raise ValueError(f'Image size {images.shape[-2:]} does not match the calibration')
+
+        flat=images.reshape(images.shape[:-2]+(-1,))
+        leftvalues=flat[...,self.left].astype(np.float64)
+        rightvalues=flat[...,self.right].astype(np.float64)
+        return (rightvalues-leftvalues)*self.weight+leftvalues
+
+
+#=================================================================
+# Computing the tables and storing them for later runs
+
+def remap_tables(linepolys, linewaves, wavelengths, ncols, rows):
+    """
+    Returns the indices of the left and right source pixels (in the
+    flattened image) and the interpolation weights for each row and
+    wavelength
+    """
+    # Pixel columns corresponding to the wavelengths for each row
+    cols=np.zeros([len(rows),len(wavelengths)])
+    for alpha, row in enumerate(rows):
+        linecols=[p(row) for p in linepolys]
+        waves=np.polynomial.Polynomial.fit(linewaves, linecols, 2)
+        cols[alpha,:]=waves(wavelengths)
+
+    # Linear interpolation between two neighbouring pixels as in np.interp,
+    # which uses the first (last) pixel for columns outside the image
+    cols=np.clip(cols,0,ncols-1)
+    left=np.floor(cols).astype(np.intp)
+    right=np.minimum(left+1,ncols-1)
+    weight=cols-left
+
+    return rows[:,np.newaxis]*ncols+left, rows[:,np.newaxis]*ncols+right, weight
+
+
+def calibration_key(linepolys, linewaves, wavelengths, ncols, firstrow, nrows):
+    """
+    A hash of everything that affects the tables, used in the cache
+    file names so that a changed calibration is never mixed with old tables
+    """
+    h=hashlib.sha1()
+    for p in linepolys:
+        h.update(np.asarray(p.coeffs, dtype=np.float64).tobytes())
+        h.update(b'|')
+    h.update(np.asarray(linewaves, dtype=np.float64).tobytes())
+    h.update(np.asarray(wavelengths, dtype=np.float64).tobytes())
+    h.update(np.array([ncols, firstrow, nrows], dtype=np.int64).tobytes())
+    return h.hexdigest()[:16]
+
+
+_TABLES=('left','right','weight')
+
+def _tablefile(cachedir, key, name):
+    return os.path.join(cachedir, f'smile-{key}-{name}.npy')
+
+
+def load_tables(cachedir, key):
+    """
+    Memory-map the tables from the cache, or return None if they are not
+    there (yet)
+    """
+    try:
+        return tuple(np.load(_tablefile(cachedir,key,name), mmap_mode='r') for name in _TABLES)
+    except (OSError, ValueError):
+        return None
+
+
+def save_tables(cachedir, key, tables):
+    """
+    Store the tables into the cache. Each file is written under a temporary
+    name and then renamed, so that other processes never see a partial file.
+    The left table is written last as load_tables looks for it first.
+    """
+    os.makedirs(cachedir, exist_ok=True)
+    for name, table in reversed(list(zip(_TABLES, tables))):
+        filename=_tablefile(cachedir,key,name)
+        tmpfile=f'{filename}.{os.getpid()}.tmp'
+        with open(tmpfile,'wb') as f:
+            np.save(f, table)
+        os.replace(tmpfile, filename)
@@ -5,6 +5,9 @@ Traverse the MISS data directory and check for any missing keograms
 """
 
 import datetime
+import os
+import sys
+from functools import partial
 from os.path import isfile, join, basename, isdir
 
 from glob import glob # It might be better to get an iterator?
@@ -14,29 +17,60 @@ import matplotlib.pyplot as plt
 import matplotlib.colors as colors
 from scipy import signal
 
+from miss_io import readpgm
+from miss_filter import filtered_lines
+
+sys.path.append(join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from archive_index import ArchiveIndex
+from backfill import run_backfill
+from keogram_raster import RasterKeogram
+from figure_template import FigureTemplate
+
+
 #=================================================================
-# A user called Felix wrote a nice short reading routine for ASCII PGM-files
-# https://stackoverflow.com/questions/46944048/how-to-read-pgm-p2-image-in-python
+# The figure of the keogram
 
-def readpgm(name):
-    with open(name) as f:
-        lines = f.readlines()
+def keogram_figure(rgbkeo, titleDate):
+    """
+    The figure of the RGB keogram of one day
+    """
+    fig, (ax0) = plt.subplots(1,1)
+    pngwidth=800
+    pngheight=400
+    mydpi=100
+    fig.set_size_inches(pngwidth/mydpi,pngheight/mydpi)
 
-    # Ignores commented lines
-    for l in list(lines):
-        if l[0] == '#':
-            lines.remove(l)
+    ax0.set_xlabel('Time (UT)')
+    ax0.set_ylabel('Meridian')
+    plt.sca(ax0)
 
-    # Makes sure it is ASCII format (P2)
-    assert lines[0].strip() == 'P2', 'File not an ASCII PGM-file'
+    plt.xticks(np.arange(0,24,3)*60,np.arange(0,24,3))
+    plt.yticks(np.arange(-90,90+45,45)+90,np.arange(-90,90+45,45))
+    
+    c=ax0.imshow(rgbkeo, aspect='auto')
+                 #extent=[xlims[0],xlims[1],-90,90], aspect='auto')
 
-    # Converts data to a list of integers
-    data = []
-    for line in lines[1:]:
-        data.extend([int(c) for c in line.split()])
+    ax0.set_title('Meridian Imaging Spectrograph in Svalbard (KHO/UNIS) '
+                 + titleDate, fontsize=14)
 
-    data=(np.array(data[3:]),(data[1],data[0]),data[2])
-    return np.reshape(data[0],data[1])
+    fig.tight_layout()
+    #plt.show()
+    return fig
+
+
+# The renderers are created once in each process: the raster renderer (see
+# keogram_raster.py) or the Matplotlib figure reused for each keogram (see
+# figure_template.py)
+_renderers={}
+
+def keogram_renderer(raster=True):
+    if raster not in _renderers:
+        if raster:
+            _renderers[raster]=RasterKeogram(keogram_figure, (180,24*60,3), '0000-00-00')
+        else:
+            _renderers[raster]=FigureTemplate(keogram_figure(np.zeros((180,24*60,3)), '0000-00-00'),
+                                              '0000-00-00', dpi=100)
+    return _renderers[raster]
 
 
 #=================================================================
@@ -44,7 +78,7 @@ def readpgm(name):
 # Form the path to the data files and list the files that
 # appear to be correct (i.e. pgm-files)
 
-def createKeogram(basepath, myday, savefilename):
+def createKeogram(basepath, myday, savefilename, renderer=None):
     #basepath='D:\\MISSTEST'
     #myday=datetime.date(2017,12,18) #time.utcnow()
 
@@ -55,7 +89,7 @@ def createKeogram(basepath, myday, savefilename):
     myfiles=glob(globpath)
 
     if(len(myfiles)==0):
-        return
+        return False
 
     #-------------------------------------------------------------
     # Prepare empty keograms to be filled by processing all files
@@ -99,7 +133,7 @@ def createKeogram(basepath, myday, savefilename):
 
             # Bin the data if required
             if(thisimage.shape==(1039,347)):
-                thisimage=thisimage[:-1,:] # Ignore the last column
+                thisimage=thisimage[:-1,:].astype('float64') # Ignore the last column
                 thisimage=(thisimage[0::3,:]+thisimage[1::3,:]+thisimage[2::3,:])/3.0
 
 
@@ -109,9 +143,9 @@ def createKeogram(basepath, myday, savefilename):
             # is not a proper background subtraction that should be done
             # by choosing column next to the spectral line column.
             
-            thisimage=signal.medfilt2d(thisimage.astype('float32'))
-            bg=np.average(thisimage[0:30,0:30])
-            thisimage=np.maximum(0,thisimage-bg)
+            # Only the rows around the emission lines and the background
+            # corner are filtered.
+            band557, band630, band428=filtered_lines(thisimage, [159, 224, 34], axis=0)
             
             index=thisfiletime.hour*60+thisfiletime.minute
 
@@ -122,7 +156,7 @@ def createKeogram(basepath, myday, savefilename):
             # New version: with 4-times binning in X-direction we should
             # sum three rows to get a 12-pixel binning in spectrum
 
-            myline=thisimage[159,:]+thisimage[158,:]+thisimage[160,:]
+            myline=band557
             #mylinebg=thisimage[164,:]
 
             thisline=np.interp(datavals,np.arange(0,len(myline)),myline)
@@ -131,7 +165,7 @@ def createKeogram(basepath, myday, savefilename):
 
             # Process 630.0nm
 
-            myline=thisimage[224,:]+thisimage[223,:]+thisimage[225,:]
+            myline=band630
             #mylinebg=thisimage[217,:]
 
             thisline=np.interp(datavals,np.arange(0,len(myline)),myline)
@@ -140,7 +174,7 @@ def createKeogram(basepath, myday, savefilename):
 
             # Process 427.8nm
 
-            myline=thisimage[34,:]+thisimage[33,:]+thisimage[35,:]
+            myline=band428
             #mylinebg=thisimage[36,:]
 
             thisline=np.interp(datavals,np.arange(0,len(myline)),myline)
@@ -151,76 +185,73 @@ def createKeogram(basepath, myday, savefilename):
             print('Could not process', thisfile)
 
 
-    fig, (ax0) = plt.subplots(1,1)
-    pngwidth=800
-    pngheight=400
-    mydpi=100
-    fig.set_size_inches(pngwidth/mydpi,pngheight/mydpi)
-
-
     #-------- RGB composite
     rgbkeo=np.zeros((180,24*60,3))
     rgbkeo[...,0]=np.sqrt(np.minimum(1,keo630/1500.0))
     rgbkeo[...,1]=np.sqrt(np.minimum(1,keo557/3000.0))
     rgbkeo[...,2]=np.sqrt(np.minimum(1,keo428/1000.0))
-    ax0.set_xlabel('Time (UT)')
-    ax0.set_ylabel('Meridian')
-    plt.sca(ax0)
-
-    plt.xticks(np.arange(0,24,3)*60,np.arange(0,24,3))
-    plt.yticks(np.arange(-90,90+45,45)+90,np.arange(-90,90+45,45))
-    
-    c=ax0.imshow(rgbkeo, aspect='auto')
-                 #extent=[xlims[0],xlims[1],-90,90], aspect='auto')
 
-    ax0.set_title('Meridian Imaging Spectrograph in Svalbard (KHO/UNIS) '
-                 + thisfiletime.strftime('%Y-%m-%d'), fontsize=14)
+    titleDate=thisfiletime.strftime('%Y-%m-%d')
 
-    fig.tight_layout()
-    #plt.show()
-
-    # Store the summary plot into monthly directories
-
-#    keoname='MISS-'+myday.strftime('%Y%m%d')+'.png'
-#    monthpath=join(basepath,myday.strftime('%Y'),myday.strftime('%m'))
-
-    #savefilename=keoname
-#    savefilename=join(monthpath,keoname)
-    plt.savefig(savefilename,dpi=mydpi)
+    # Store the summary plot. The raster renderer draws the same layout
+    # faster, otherwise the Matplotlib figure of the process is reused.
+    if renderer is None:
+        renderer=keogram_renderer(raster=False)
+    renderer.render(rgbkeo, savefilename, titleDate)
     print('Stored ' + savefilename)
+    return True
 
 
 #======================================================================
 
-
-basepath='C:\\Users\\mikkos\\MISS'
-basepath='u:\\'
-
-for year in [2023, 2024]:
-    for month in range(10,13):
-        for day in range(1,32):
-
-            # Form a correct directory name for each day,
-            # ignore impossible dates :-)
-
-            checkDir=join(basepath,'{:04d}'.format(year),
-                      '{:02d}'.format(month),
-                      '{:02d}'.format(day))
-
-            if(isdir(checkDir)):
-                myday=datetime.date(year,month,day)
-                # Skip today's data (and similarly all future days)
-                todayutc=datetime.datetime.utcnow().date()
-                if(myday>=todayutc):
-                    continue
-                
-                # Store the keograms into monthly directories
-                monthpath=join(basepath,myday.strftime('%Y'),
-                               myday.strftime('%m'))
-                keoname=join(monthpath,'MISS-RGB-'+myday.strftime('%Y%m%d')+'.png')
-         
-                if(isfile(keoname)==False):
-                    print('Missing keogram for',checkDir)
-                    createKeogram(basepath,myday,keoname)
-                
-                    
+def createMissingKeogram(basepath, year, month, day):
+    """
+    Create the keogram for one day if there is data but no keogram yet.
+    Returns a short status for the backfill summary.
+    """
+    # Form a correct directory name for each day
+
+    checkDir=join(basepath,'{:04d}'.format(year),
+              '{:02d}'.format(month),
+              '{:02d}'.format(day))
+
+    if(isdir(checkDir)==False):
+        return 'no data'
+
+    myday=datetime.date(year,month,day)
+    # Skip today's data (and similarly all future days)
+    todayutc=datetime.datetime.utcnow().date()
+    if(myday>=todayutc):
+        return 'too recent'
+
+    # Store the keograms into monthly directories
+    monthpath=join(basepath,myday.strftime('%Y'),
+                   myday.strftime('%m'))
+    keoname=join(monthpath,'MISS-RGB-'+myday.strftime('%Y%m%d')+'.png')
+
+    if(isfile(keoname)==True):
+        return 'exists'
+
+    print('Missing keogram for',checkDir)
+    if createKeogram(basepath,myday,keoname,keogram_renderer()):
+        return 'created'
+    return 'empty'
+
+
+if __name__ == "__main__":
+    basepath='C:\\Users\\mikkos\\MISS'
+    basepath='u:\\'
+
+    # The days are independent jobs on a pool of processes, None uses
+    # all cores and 1 processes the days one at a time
+    workers=None
+
+    # The archive index knows which days have data but no keogram, so
+    # there is no need to check each possible day over the network. The
+    # index itself is kept on the local disk.
+    with ArchiveIndex('miss-archive-index.sqlite') as index:
+        index.refresh(basepath)
+        days=[(myday.year,myday.month,myday.day) for myday in index.missing_days('MISS','MISS-RGB')
+              if myday.year in [2023, 2024] and myday.month in range(10,13)]
+
+    run_backfill(partial(createMissingKeogram, basepath), days, workers)
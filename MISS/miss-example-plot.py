@@ -16,29 +16,7 @@ from mpl_toolkits.axes_grid1 import make_axes_locatable
 from matplotlib import transforms
 from scipy import signal
 
-#=================================================================
-# A user called Felix wrote a nice short reading routine for ASCII PGM-files
-# https://stackoverflow.com/questions/46944048/how-to-read-pgm-p2-image-in-python
-
-def readpgm(name):
-    with open(name) as f:
-        lines = f.readlines()
-
-    # Ignores commented lines
-    for l in list(lines):
-        if l[0] == '#':
-            lines.remove(l)
-
-    # Makes sure it is ASCII format (P2)
-    assert lines[0].strip() == 'P2', 'File not an ASCII PGM-file'
-
-    # Converts data to a list of integers
-    data = []
-    for line in lines[1:]:
-        data.extend([int(c) for c in line.split()])
-
-    data=(np.array(data[3:]),(data[1],data[0]),data[2])
-    return np.reshape(data[0],data[1])
+from miss_io import readpgm
 
 
 #=====================================================
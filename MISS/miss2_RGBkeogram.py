@@ -13,6 +13,8 @@ for the smaller images.
 """
 
 
+import os
+import sys
 from os.path import isfile, join, basename, isdir
 
 #from glob import glob # It might be better to get an iterator?
@@ -22,36 +24,91 @@ import matplotlib.colors as colors
 import matplotlib.dates as mdates
 import datetime as dt
 import glob
+from functools import partial
 
 from scipy import signal
-from PIL import Image
 
-def read_miss2(filename):
+from miss_io import read_miss2
+from miss_cube import day_frames
+from miss_filter import filtered_lines
+
+sys.path.append(join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from archive_index import ArchiveIndex
+from backfill import run_backfill
+from keogram_raster import RasterKeogram
+from figure_template import FigureTemplate
+
+
+#=================================================================
+# The figure of the keogram
+
+def keogram_figure(rgbkeo, titleDate):
     """
-    Read a MISS png-image, flip and rotate to have north up and increasing wavelength towards right.
+    The figure of the RGB keogram of one day
     """
-    missImage=np.array(Image.open(filename))
+    fig, ax = plt.subplots(1,1)
+    fig.suptitle(f"MISS-2 (KHO/UNIS) {titleDate}", fontsize=16)
+    ax.set_title("RGB composite from 427.8, 557.7 and 630.0 nm emission lines", fontsize=11)
 
-    # The raw data has 1039 rows with 347 columns, do some flipping 
-    thisimage=np.fliplr(np.rot90(missImage))
-    
-    return thisimage
+
+    pngwidth=800
+    pngheight=400
+    mydpi=100
+    fig.set_size_inches(pngwidth/mydpi,pngheight/mydpi)
+
+    hours=mdates.HourLocator(byhour=range(0,24,2))
+    d_fmt=mdates.DateFormatter('%H:%M')
+    #xlims=mdates.date2num([min(datapoints),max(datapoints)])
+
+    ax.set_ylabel('Zenith angle')
+    ax.set_xlabel('Time (UT)')
+    #plt.sca(ax3)
+
+    ax.xaxis_date()
+    ax.xaxis.set_major_locator(hours)
+    ax.xaxis.set_major_formatter(d_fmt)
+
+    ax.set_xticks(np.arange(0,24,3)*60,np.arange(0,24,3))                 
+    ax.set_yticks(np.arange(-90,90+45,45),np.arange(-90,90+45,45))
+    ax.set_yticklabels(['South', '-45°', 'Zenith', '45° N','North'])#, fontsize = 14)
+    c=ax.imshow(rgbkeo, aspect='auto', extent=[0,24*60,-90,90])
+
+
+
+    fig.tight_layout()
+    #plt.show()
+    return fig
+
+
+# The renderers are created once in each process: the raster renderer (see
+# keogram_raster.py) or the Matplotlib figure reused for each keogram (see
+# figure_template.py)
+_renderers={}
+
+def keogram_renderer(raster=True):
+    if raster not in _renderers:
+        if raster:
+            _renderers[raster]=RasterKeogram(keogram_figure, (180,24*60,3), '0000-00-00')
+        else:
+            _renderers[raster]=FigureTemplate(keogram_figure(np.zeros((180,24*60,3)), '0000-00-00'),
+                                              '0000-00-00', dpi=100)
+    return _renderers[raster]
 
 
 #=================================================================
 # Create a keogram from the last X hours of data
 # - search for matching files based on the current time
 
-def createRGBkeogram(basepath, myday, savefilename):
+def createRGBkeogram(basepath, myday, savefilename, cubepath=None, renderer=None):
     print('Checking data for', myday)
-    dirpath=join(myday.strftime('%Y'),myday.strftime('%m'),myday.strftime('%d'))
-    globpath=join(basepath,dirpath,'MISS2-????????-??????.png')
-    #print(globpath)
-    myfiles=glob.glob(globpath)
 
-    if(len(myfiles)==0):
+    # Use the frame cube of the day if one has been ingested (see
+    # miss_cube.py), otherwise decode the individual png-files
+    myframes=day_frames(basepath, myday, 'MISS2', cubepath)
+
+    if(len(myframes)==0):
         print("No data for ",myday)
-        return
+        return False
 
     #-------------------------------------------------------------
     # Prepare empty keograms to be filled by processing all files
@@ -88,15 +145,13 @@ def createRGBkeogram(basepath, myday, savefilename):
     red_col=807
     keogramIsEmpty=True
 
-    for thisfile in myfiles:
-        thisbasename=basename(thisfile)
-        filetime=dt.datetime.strptime(thisbasename,'MISS2-%Y%m%d-%H%M%S.png')
+    for filetime, thisbasename, loadframe in myframes:
         thisfiletime=filetime.replace(tzinfo=dt.timezone.utc)
         if (thisfiletime.second != 0):
             continue
 
         try:
-            thisimage=read_miss2(thisfile)
+            thisimage=loadframe()
 
             # Ignore spectral images that are not of correct size
             if thisimage.shape!=(347,1039):
@@ -105,10 +160,10 @@ def createRGBkeogram(basepath, myday, savefilename):
 
             # Process the image to filter noisy pixels out. Also,
             # estimate the background from the side of the image and
-            # subtract that as well.
-            thisimage=signal.medfilt2d(thisimage.astype('float32'))
-            bg=np.average(thisimage[0:30,0:30])
-            thisimage=np.maximum(0,thisimage-bg)
+            # subtract that as well. Only the columns around the emission
+            # lines and the background corner are filtered.
+            band428, band557, band630=filtered_lines(thisimage,
+                                                     [blue_col, green_col, red_col], axis=1)
             
             index=thisfiletime.hour*60+thisfiletime.minute
             print('     ',thisbasename, index)
@@ -127,51 +182,35 @@ def createRGBkeogram(basepath, myday, savefilename):
             # Process 557.7nm
             # - pixel column
             
-            myline=thisimage[:,green_col-1]+thisimage[:,green_col]+thisimage[:,green_col+1]
+            myline=band557
             thisline=np.interp(datavals,np.arange(0,len(myline)),myline)
             keo557[:,index]=thisline
 
             #-----------------
             # Process 630.0nm
     
-            myline=thisimage[:,red_col-1]+thisimage[:,red_col]+thisimage[:,red_col+1]
+            myline=band630
             thisline=np.interp(datavals,np.arange(0,len(myline)),myline)
             keo630[:,index]=thisline
 
             #------------------
             # Process 427.8nm
     
-            myline=thisimage[:,blue_col-1]+thisimage[:,blue_col]+thisimage[:,blue_col+1]
+            myline=band428
             thisline=np.interp(datavals,np.arange(0,len(myline)),myline)
             keo428[:,index]=thisline
 
             keogramIsEmpty=False
 
         except Exception as error:
-            print('Could not process', thisfile)
+            print('Could not process', thisbasename)
             print(error)
 
     # Do not bother saving empty keograms
     if keogramIsEmpty==True:
         print(f"Empty keogram for this day, no file saved...")
-        return
-    
-    fig, ax = plt.subplots(1,1)
-    titleDate=thisfiletime.strftime('%Y-%m-%d')
-    fig.suptitle(f"MISS-2 (KHO/UNIS) {titleDate}", fontsize=16)
-    ax.set_title("RGB composite from 427.8, 557.7 and 630.0 nm emission lines", fontsize=11)
-
-
-    pngwidth=800
-    pngheight=400
-    mydpi=100
-    fig.set_size_inches(pngwidth/mydpi,pngheight/mydpi)
-
-    hours=mdates.HourLocator(byhour=range(0,24,2))
-    d_fmt=mdates.DateFormatter('%H:%M')
-    #xlims=mdates.date2num([min(datapoints),max(datapoints)])
+        return False
     
-
     #----------------
     # RGB composite
     # - the constants were manually "tuned"
@@ -181,28 +220,16 @@ def createRGBkeogram(basepath, myday, savefilename):
     rgbkeo[...,1]=np.clip(np.sqrt(keo557/60000), a_min=0, a_max=1)
     rgbkeo[...,2]=np.clip(np.sqrt(keo428/10000), a_min=0, a_max=1)
 
-    ax.set_ylabel('Zenith angle')
-    ax.set_xlabel('Time (UT)')
-    #plt.sca(ax3)
-
-    ax.xaxis_date()
-    ax.xaxis.set_major_locator(hours)
-    ax.xaxis.set_major_formatter(d_fmt)
-
-    ax.set_xticks(np.arange(0,24,3)*60,np.arange(0,24,3))                 
-    ax.set_yticks(np.arange(-90,90+45,45),np.arange(-90,90+45,45))
-    ax.set_yticklabels(['South', '-45°', 'Zenith', '45° N','North'])#, fontsize = 14)
-    c=ax.imshow(rgbkeo, aspect='auto', extent=[0,24*60,-90,90])
-
-
-
-    fig.tight_layout()
-    #plt.show()
-
-    # Store the summary plot into monthly directories
+    titleDate=thisfiletime.strftime('%Y-%m-%d')
 
-    plt.savefig(savefilename,dpi=mydpi)
+    # Store the summary plot into monthly directories. The raster renderer
+    # draws the same layout faster, otherwise the Matplotlib figure of the
+    # process is reused.
+    if renderer is None:
+        renderer=keogram_renderer(raster=False)
+    renderer.render(rgbkeo, savefilename, titleDate)
     print('Stored ' + savefilename)
+    return True
 
 # For development, it's convenient to have the data stored...
     #np.save("keo557",keo557);
@@ -214,8 +241,13 @@ def createRGBkeogram(basepath, myday, savefilename):
 #======================================================================
 
 def createKeogram(year,month,day,overWrite=False):
+    """
+    Create the keogram for one day unless it exists already. Returns a short
+    status for the backfill summary.
+    """
     basepath='d:\\'
     basepath=join(basepath,"KHO","MISS-2")
+    cubepath=join(basepath,"Cubes")
     checkDir=join(basepath,'{:04d}'.format(year),
             '{:02d}'.format(month),
             '{:02d}'.format(day))
@@ -226,7 +258,7 @@ def createKeogram(year,month,day,overWrite=False):
         # Skip today's data (and similarly all future days)
         todayutc=dt.datetime.now(dt.timezone.utc)
         if(myday>=todayutc):
-            return
+            return 'too recent'
         
         # Store the keograms into monthly directories
         monthpath=join(basepath,myday.strftime('%Y'),
@@ -235,12 +267,26 @@ def createKeogram(year,month,day,overWrite=False):
 
         if(overWrite==True or isfile(keoname)==False):
             print('Creating keogram for',checkDir)
-            createRGBkeogram(basepath,myday,keoname)
+            if createRGBkeogram(basepath,myday,keoname,cubepath,keogram_renderer()):
+                return 'created'
+            return 'empty'
         else:
             print(f"Skipping existing {keoname}")
+            return 'exists'
+    return 'no data'
 
 if __name__ == "__main__":
-    for year in [2024, 2025, 2026]:
-        for month in [1, 2, 3, 10, 11, 12]:
-            for day in range(1,32):
-                createKeogram(year,month,day, overWrite=True)
\ No newline at end of file
+    # The days are independent jobs on a pool of processes. Set the number
+    # of worker processes to match the computer (None uses all cores, 1
+    # processes the days one at a time).
+    workers=None
+
+    # Find the days with data from the archive index instead of probing
+    # every possible day directory
+    basepath=join('d:\\',"KHO","MISS-2")
+    with ArchiveIndex(join(basepath,'archive-index.sqlite')) as index:
+        index.refresh(basepath)
+        days=[(myday.year,myday.month,myday.day) for myday in index.days('MISS2')
+              if myday.year in [2024, 2025, 2026] and myday.month in [1, 2, 3, 10, 11, 12]]
+
+    run_backfill(partial(createKeogram, overWrite=True), days, workers)
@@ -0,0 +1,320 @@
+"""
+Benchmark the MISS keogram and spectral processing
+
+Synthetic MISS (ASCII PGM) and MISS-2 (16-bit PNG) frames are generated
+with the real 1039x347 geometry, emission lines along the calibrated
+"smiley" and some hot pixels for the median filter. Each processing stage
+is then timed separately:
+
+    decode         readpgm and read_miss2
+    filter         full frame median filtering (as in the calibration)
+    extraction     filtered_lines, i.e. filtering and summing the line bands
+    interpolation  np.interp of the lines into the keogram, and the smile
+                   correction (miss2spectral)
+    calibration    detect_emission_line on a smoothed frame
+    render         drawing the RGB keogram figure
+    save           storing the keogram png-file
+    render-raster  drawing and storing the same keogram with keogram_raster.py
+    keogram        createRGBkeogram and createKeogram from start to end
+
+The results (seconds, throughput per second and peak memory) are written
+into a JSON-file so that runs from different commits can be compared:
+
+    python miss_benchmark.py results.json
+    python miss_benchmark.py results-new.json results.json
+
+"""
+
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from os.path import dirname, abspath, join
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg') # No windows, the figures are only rendered and saved
+import matplotlib.pyplot as plt
+from PIL import Image
+from scipy import signal
+
+from miss_io import readpgm, read_miss2
+from miss_filter import filtered_lines
+from miss2_RGBkeogram import createRGBkeogram, keogram_figure, keogram_renderer
+from createmissingRGBkeograms import createKeogram
+
+sys.path.append(join(dirname(abspath(__file__)),'Spectral calibration'))
+from miss2_spectral import miss2spectral, p_blue, p_green, p_red, p_red2
+from miss2_calibration import detect_emission_line
+
+#=================================================================
+# Synthetic data
+
+def synthetic_miss2(rng):
+    """
+    A MISS-2 frame (347,1039) as returned by read_miss2: background, noise,
+    four emission lines following the calibration polynomials and hot pixels
+    """
+    rows, cols=np.mgrid[0:347,0:1039]
+    frame=300+rng.normal(0,15,(347,1039))
+
+    # An auroral arc along the meridian, brightest somewhere in the field-of-view
+    arc=np.exp(-0.5*((rows[:,0]-rng.uniform(100,250))/rng.uniform(10,40))**2)
+    for p, peak in zip([p_blue, p_green, p_red, p_red2], [2000, 8000, 3000, 1000]):
+        linecol=p(rows)
+        frame+=peak*rng.uniform(0.2,1.0)*arc[:,np.newaxis]*np.exp(-0.5*((cols-linecol)/1.5)**2)
+
+    hot=rng.integers(0,frame.size,200)
+    frame.flat[hot]=15000
+    return np.clip(frame,0,65535).astype(np.uint16)
+
+
+def synthetic_miss(rng):
+    """
+    A MISS frame (1039,347) as returned by readpgm, with the emission lines
+    along the rows used by createmissingRGBkeograms.py (after 3x binning)
+    """
+    rows=np.arange(1039)
+    frame=300+rng.normal(0,15,(1039,347))
+
+    arc=np.exp(-0.5*((np.arange(347)-rng.uniform(70,267))/rng.uniform(10,40))**2)
+    for binnedrow, peak in zip([159, 224, 34], [8000, 3000, 2000]):
+        profile=np.exp(-0.5*((rows-3*binnedrow-1)/2.0)**2)
+        frame+=peak*rng.uniform(0.2,1.0)*profile[:,np.newaxis]*arc[np.newaxis,:]
+
+    hot=rng.integers(0,frame.size,200)
+    frame.flat[hot]=15000
+    return np.clip(frame,0,65535).astype(np.uint16)
+
+
+def write_pgm(filename, frame, frametime):
+    """
+    Write an ASCII PGM-file like the ones from the instrument
+    """
+    with open(filename,'w') as f:
+        f.write(f"P2\n# {frametime.strftime('%Y-%m-%d %H:%M:%S')} UT\n")
+        f.write(f'{frame.shape[1]} {frame.shape[0]}\n65535\n')
+        np.savetxt(f, frame, fmt='%d')
+
+
+def write_png(filename, frame):
+    """
+    Write a MISS-2 frame as the raw 16-bit png-file (undoing read_miss2)
+    """
+    raw=np.rot90(np.fliplr(frame),-1)
+    Image.fromarray(np.ascontiguousarray(raw)).save(filename)
+
+
+def create_dataset(basepath, myday, nframes, nvariants=8, seed=1):
+    """
+    Write nframes one-minute MISS and MISS-2 frames for one day into the
+    usual year/month/day directories under basepath. Only nvariants
+    different frames are generated to keep the set-up fast.
+
+    Returns the MISS-2 frames, the MISS frames and the file names
+    """
+    rng=np.random.default_rng(seed)
+    miss2frames=[synthetic_miss2(rng) for i in range(nvariants)]
+    missframes=[synthetic_miss(rng) for i in range(nvariants)]
+
+    daypath=join(basepath,myday.strftime('%Y'),myday.strftime('%m'),myday.strftime('%d'))
+    os.makedirs(daypath, exist_ok=True)
+
+    pngfiles=[]
+    pgmfiles=[]
+    for i in range(nframes):
+        frametime=dt.datetime.combine(myday,dt.time())+dt.timedelta(minutes=i)
+        pngfiles.append(join(daypath,frametime.strftime('MISS2-%Y%m%d-%H%M%S.png')))
+        pgmfiles.append(join(daypath,frametime.strftime('MISS-%Y%m%d-%H%M%S.pgm')))
+        write_png(pngfiles[-1], miss2frames[i%nvariants])
+        write_pgm(pgmfiles[-1], missframes[i%nvariants], frametime)
+
+    return miss2frames, missframes, pngfiles, pgmfiles
+
+#=================================================================
+# Timing
+
+def measure(name, func, count, unit='frames', repeat=3):
+    """
+    Time func() (the best of repeat runs) and then run it once more with
+    tracemalloc to find the peak memory allocated during the run
+    """
+    seconds=[]
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            starttime=time.perf_counter()
+            func()
+            seconds.append(time.perf_counter()-starttime)
+
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    peak=tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result={'count': count, 'unit': unit, 'seconds': min(seconds),
+            'per_second': count/min(seconds), 'peak_memory_mb': peak/2**20}
+    print(f"{name:28s} {result['seconds']:8.3f} s {result['per_second']:10.1f} {unit}/s "
+          f"{result['peak_memory_mb']:8.1f} MB")
+    return result
+
+
+def render_keogram(rgbkeo):
+    """
+    The figure of the MISS-2 RGB keogram drawn with keogram_figure of
+    createRGBkeogram, so that the timings follow the real figure
+    """
+    fig=keogram_figure(rgbkeo, '2025-01-01')
+    fig.canvas.draw()
+    return fig
+
+
+def run_benchmarks(nframes=60, workpath=None):
+    """
+    Create the synthetic data set and time all stages. Returns a dictionary
+    of the results for each stage.
+    """
+    myday=dt.date(2025,1,1)
+    results={}
+
+    with tempfile.TemporaryDirectory(dir=workpath) as basepath:
+        print(f'Creating {nframes} synthetic frames in {basepath}')
+        miss2frames, missframes, pngfiles, pgmfiles=create_dataset(basepath, myday, nframes)
+        frames=[miss2frames[i%len(miss2frames)] for i in range(nframes)]
+
+        def decode_pgm():
+            for name in pgmfiles:
+                readpgm(name)
+
+        def decode_png():
+            for name in pngfiles:
+                read_miss2(name)
+
+        def filter_frames():
+            for frame in frames:
+                signal.medfilt2d(frame.astype('float32'))
+
+        def extract_lines():
+            for frame in frames:
+                filtered_lines(frame, [103, 558, 807], axis=1)
+
+        mylines=[filtered_lines(frame, [103, 558, 807], axis=1) for frame in frames]
+        datavals=np.linspace(70,267, num=180)
+
+        def interpolate_lines():
+            for thislines in mylines:
+                for myline in thislines:
+                    np.interp(datavals,np.arange(0,len(myline)),myline)
+
+        stack=np.array(frames)
+
+        def spectral_frames():
+            for frame in frames:
+                miss2spectral(frame)
+
+        def spectral_stack():
+            miss2spectral(stack)
+
+        smoothframes=[signal.medfilt2d(signal.medfilt2d(frame.astype('float32'))) for frame in frames]
+
+        def detect_lines():
+            for smoothimage in smoothframes:
+                for col_centre in [556, 807, 829, 84]:
+                    detect_emission_line(range(80,270,15), col_centre, 10, smoothimage)
+
+        rng=np.random.default_rng(2)
+        rgbkeo=rng.uniform(0,1,(180,24*60,3))
+
+        def render():
+            plt.close(render_keogram(rgbkeo))
+
+        fig=render_keogram(rgbkeo)
+        savename=join(basepath,'keogram.png')
+
+        def save():
+            fig.savefig(savename, dpi=100)
+
+        renderer=keogram_renderer()
+
+        def render_raster():
+            renderer.render(rgbkeo, savename, '2025-01-01')
+
+        def keogram_miss2():
+            createRGBkeogram(basepath, myday, join(basepath,'MISS2-RGB.png'))
+
+        def keogram_miss():
+            createKeogram(basepath, myday, join(basepath,'MISS-RGB.png'))
+
+        # Make sure that the smile correction tables exist before timing
+        miss2spectral(frames[0])
+
+        results['decode-pgm']=measure('decode-pgm', decode_pgm, nframes)
+        results['decode-png']=measure('decode-png', decode_png, nframes)
+        results['filter-fullframe']=measure('filter-fullframe', filter_frames, nframes)
+        results['extraction']=measure('extraction', extract_lines, nframes)
+        results['interpolation-keogram']=measure('interpolation-keogram', interpolate_lines, nframes)
+        results['interpolation-spectral']=measure('interpolation-spectral', spectral_frames, nframes)
+        results['interpolation-spectral-stack']=measure('interpolation-spectral-stack',
+                                                        spectral_stack, nframes)
+        results['detect-emission-line']=measure('detect-emission-line', detect_lines, nframes)
+        results['render']=measure('render', render, 1, 'keograms')
+        results['save']=measure('save', save, 1, 'keograms')
+        plt.close(fig)
+        results['render-raster']=measure('render-raster', render_raster, 1, 'keograms')
+        results['keogram-miss2']=measure('keogram-miss2', keogram_miss2, nframes, repeat=1)
+        results['keogram-miss']=measure('keogram-miss', keogram_miss, nframes, repeat=1)
+
+    return results
+
+
+def environment():
+    """
+    Versions and the git commit to identify the run
+    """
+    try:
+        commit=subprocess.run(['git','rev-parse','--short','HEAD'], capture_output=True,
+                              text=True, cwd=dirname(abspath(__file__))).stdout.strip()
+    except OSError:
+        commit=''
+    return {'commit': commit, 'date': dt.datetime.now(dt.timezone.utc).isoformat(),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'system': platform.system()}
+
+
+def compare(results, baseline):
+    """
+    Print the speed-up of each stage compared to an earlier run
+    """
+    print(f"Compared to {baseline['environment']['commit']}:")
+    for name, result in results['stages'].items():
+        if name not in baseline['stages']:
+            continue
+        old=baseline['stages'][name]
+        print(f"{name:28s} {old['seconds']/result['seconds']:6.2f}x faster, "
+              f"memory {result['peak_memory_mb']-old['peak_memory_mb']:+8.1f} MB")
+
+
+#======================================================================
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2,3):
+        sys.exit("miss_benchmark [results.json] [baseline.json]")
+
+    nframes=60
+    results={'environment': environment(), 'nframes': nframes,
+             'stages': run_benchmarks(nframes)}
+
+    with open(sys.argv[1],'w') as f:
+        json.dump(results, f, indent=2)
+    print('Stored', sys.argv[1])
+
+    if len(sys.argv)==3:
+        with open(sys.argv[2]) as f:
+            compare(results, json.load(f))
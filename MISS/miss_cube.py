@@ -0,0 +1,169 @@
+"""
+Pack a night of MISS frames into a single memory-mappable cube
+
+Every keogram, calibration and spectral script would otherwise decode
+each frame again from the individual PGM/PNG-files. The ingest stage
+below stores all frames of one day into a (time, rows, cols) uint16
+array (a NumPy .npy-file) with the frame timestamps stored beside it, so
+that later processing can slice the data without decoding the files again.
+
+The frames are stored exactly as returned by the instrument reader, i.e.
+MISS-2 frames have north up and increasing wavelength towards right.
+
+"""
+
+import datetime as dt
+import os
+from functools import partial
+from glob import glob
+from os.path import basename, isfile, join
+
+import numpy as np
+
+from miss_io import read_miss2, readpgm
+
+#=================================================================
+# Filename conventions, readers and the expected frame size for each
+# instrument. Frames of any other size are ignored (the binning was
+# different during the early MISS-2 season 2024-2025).
+
+INSTRUMENTS={
+    'MISS2': ('MISS2-????????-??????.png', 'MISS2-%Y%m%d-%H%M%S.png', read_miss2, (347,1039)),
+    'MISS': ('MISS-????????-??????.pgm', 'MISS-%Y%m%d-%H%M%S.pgm', readpgm, None),
+}
+
+
+def cube_filenames(cubepath, instrument, myday):
+    """
+    Names of the frame cube and the timestamp index for one day
+    """
+    name=f"{instrument}-{myday.strftime('%Y%m%d')}"
+    return join(cubepath,name+'-frames.npy'), join(cubepath,name+'-times.npy')
+
+
+def ingest_night(basepath, myday, cubepath, instrument='MISS2', overWrite=False):
+    """
+    Decode all frames of one day and store them into a (time, rows, cols)
+    uint16 cube with a datetime64 index of the frame times.
+
+    Returns the name of the cube file or None if there is no data.
+    """
+    globpattern, namepattern, reader, shape=INSTRUMENTS[instrument]
+
+    dirpath=join(myday.strftime('%Y'),myday.strftime('%m'),myday.strftime('%d'))
+    myfiles=sorted(glob(join(basepath,dirpath,globpattern)))
+    if len(myfiles)==0:
+        print("No data for ",myday)
+        return None
+
+    framesfile, timesfile=cube_filenames(cubepath,instrument,myday)
+    if overWrite==False and isfile(framesfile) and isfile(timesfile):
+        print(f"Skipping existing {framesfile}")
+        return framesfile
+
+    os.makedirs(cubepath, exist_ok=True)
+
+    # Write into a temporary file first so that an interrupted ingest
+    # never leaves a cube that looks complete
+    tmpfile=framesfile+'.part'
+    cube=None
+    times=[]
+
+    for thisfile in myfiles:
+        thisbasename=basename(thisfile)
+        try:
+            filetime=dt.datetime.strptime(thisbasename,namepattern)
+            thisimage=reader(thisfile)
+        except Exception as error:
+            print('Could not process', thisfile)
+            print(error)
+            continue
+
+        # Use the first decoded frame for the frame size if the instrument
+        # does not have a fixed one
+        if shape is None:
+            shape=thisimage.shape
+        if thisimage.shape!=shape:
+            print(f'Ignoring {thisbasename} with frame size {thisimage.shape}')
+            continue
+
+        if cube is None:
+            cube=np.lib.format.open_memmap(tmpfile, mode='w+', dtype=np.uint16,
+                                           shape=(len(myfiles),)+shape)
+        cube[len(times)]=thisimage
+        times.append(filetime)
+
+    if cube is None:
+        print("No usable frames for ",myday)
+        return None
+
+    # The cube was allocated for all files of the day, the index tells how
+    # many of the frames are in use
+    cube.flush()
+    del cube
+    os.replace(tmpfile,framesfile)
+    np.save(timesfile,np.array(times,dtype='datetime64[s]'))
+    print(f'Stored {len(times)} frames into {framesfile}')
+    return framesfile
+
+
+def load_night_cube(cubepath, instrument, myday):
+    """
+    Memory-map the frame cube of one day.
+
+    Returns (frames, times) where frames is a read-only (time, rows, cols)
+    array and times the datetime64 timestamps of the frames, or None if
+    there is no cube for the day.
+    """
+    framesfile, timesfile=cube_filenames(cubepath,instrument,myday)
+    if not (isfile(framesfile) and isfile(timesfile)):
+        return None
+
+    times=np.load(timesfile)
+    frames=np.load(framesfile, mmap_mode='r')
+    return frames[:len(times)], times
+
+
+def day_frames(basepath, myday, instrument='MISS2', cubepath=None):
+    """
+    List the frames of one day as (time, name, loadframe) tuples, where
+    loadframe() returns the decoded frame.
+
+    If cubepath is given and there is a cube for the day, the frames are
+    sliced from the memory-mapped cube instead of decoding the raw files.
+    """
+    globpattern, namepattern, reader, shape=INSTRUMENTS[instrument]
+
+    cube=None
+    if cubepath is not None:
+        cube=load_night_cube(cubepath,instrument,myday)
+
+    if cube is not None:
+        frames, times=cube
+        return [(filetime, filetime.strftime(namepattern), partial(frames.__getitem__, i))
+                for i, filetime in enumerate(times.tolist())]
+
+    dirpath=join(myday.strftime('%Y'),myday.strftime('%m'),myday.strftime('%d'))
+    myfiles=glob(join(basepath,dirpath,globpattern))
+
+    frames=[]
+    for thisfile in myfiles:
+        thisbasename=basename(thisfile)
+        filetime=dt.datetime.strptime(thisbasename,namepattern)
+        frames.append((filetime, thisbasename, partial(reader, thisfile)))
+    return frames
+
+
+#======================================================================
+
+if __name__ == "__main__":
+    basepath=join('d:\\',"KHO","MISS-2")
+    cubepath=join(basepath,"Cubes")
+    for year in [2024, 2025, 2026]:
+        for month in [1, 2, 3, 10, 11, 12]:
+            for day in range(1,32):
+                try:
+                    myday=dt.date(year,month,day)
+                except ValueError:
+                    continue
+                ingest_night(basepath,myday,cubepath)
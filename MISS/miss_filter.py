@@ -0,0 +1,59 @@
+"""
+Median filtering of only those parts of a MISS image that are used
+
+The keograms only use three narrow bands of the image (the emission lines)
+and a small corner for the background estimate, so filtering the whole
+frame is mostly wasted effort. The routines below filter just the needed
+regions plus the margin required by the filter kernel. As medfilt2d pads
+the image with zeros, a region touching the image edge sees the same zero
+padding as the full frame would, so the results are identical to filtering
+the full frame.
+
+"""
+
+import numpy as np
+from scipy import signal
+
+
+def medfilt_region(image, rows, cols, kernel_size=3):
+    """
+    Return image[rows,cols] median filtered exactly as in
+    signal.medfilt2d(image.astype('float32'), kernel_size)[rows,cols]
+    where rows and cols are slices with explicit start and stop.
+    """
+    margin=kernel_size//2
+    r0=max(rows.start-margin,0)
+    r1=min(rows.stop+margin,image.shape[0])
+    c0=max(cols.start-margin,0)
+    c1=min(cols.stop+margin,image.shape[1])
+
+    region=signal.medfilt2d(image[r0:r1,c0:c1].astype('float32'), kernel_size)
+    return region[rows.start-r0:rows.stop-r0, cols.start-c0:cols.stop-c0]
+
+
+def filtered_lines(image, centres, axis, corner=30):
+    """
+    Sum three rows (axis=0) or columns (axis=1) around each centre after
+    median filtering and removing the background, i.e. the same as
+
+        thisimage=signal.medfilt2d(image.astype('float32'))
+        bg=np.average(thisimage[0:corner,0:corner])
+        thisimage=np.maximum(0,thisimage-bg)
+        myline=thisimage[centre-1,:]+thisimage[centre,:]+thisimage[centre+1,:]
+
+    but without filtering the full image. Returns a list of lines.
+    """
+    # Estimate the background from the side of the image
+    bg=np.average(medfilt_region(image, slice(0,corner), slice(0,corner)))
+
+    mylines=[]
+    for centre in centres:
+        band=slice(centre-1,centre+2)
+        if axis==0:
+            values=medfilt_region(image, band, slice(0,image.shape[1]))
+        else:
+            values=medfilt_region(image, slice(0,image.shape[0]), band).T
+        values=np.maximum(0,values-bg)
+        mylines.append(values[0]+values[1]+values[2])
+
+    return mylines
@@ -0,0 +1,96 @@
+"""
+Readers for raw MISS data files
+
+The first years of MISS data are stored as PGM-files. Most of them are
+ASCII PGM-files (P2), but the same reader also accepts binary PGM-files (P5)
+so that converted or re-exported data can be read with the same routine.
+MISS-2 data is stored as 16-bit greyscale PNG-files.
+
+"""
+
+import re
+
+import numpy as np
+from PIL import Image
+
+#=================================================================
+# The PGM header is the magic number followed by width, height and the
+# maximum grey value. Comments (starting with '#') may appear anywhere
+# between the header fields and exactly one whitespace character separates
+# the header from the pixel data.
+
+_PGM_HEADER=re.compile(rb'\A(P[25])'
+                       rb'(?:\s|#[^\n]*\n)+(\d+)'
+                       rb'(?:\s|#[^\n]*\n)+(\d+)'
+                       rb'(?:\s|#[^\n]*\n)+(\d+)\s')
+
+_PGM_COMMENT=re.compile(rb'#[^\n]*')
+
+# The ASCII pixel data may only contain digits and whitespace
+_PGM_DIGITS=b'0123456789 \t\r\n\v\f'
+
+
+def readpgm(name):
+    """
+    Read an ASCII (P2) or binary (P5) PGM-file into a uint16 array with
+    shape (height, width).
+
+    The ASCII data is parsed in one go into a NumPy buffer. Binary data
+    is returned as a read-only view of the file contents without copying,
+    with 8-bit data widened to uint16. A ValueError is raised if the
+    maximum grey value is not 1...65535, or if the data is short, garbled
+    or has values above the maximum grey value.
+    """
+    with open(name,'rb') as f:
+        data=f.read()
+
+    header=_PGM_HEADER.match(data)
+    if header is None:
+        raise ValueError(f'{name} is not a PGM-file')
+
+    magic=header.group(1)
+    width, height, maxval=(int(x) for x in header.group(2,3,4))
+    npixels=width*height
+    if not 0<maxval<=65535:
+        raise ValueError(f'Invalid maximum grey value {maxval} in {name}')
+
+    if magic==b'P5':
+        pixeltype=np.dtype('>u2') if maxval>255 else np.dtype('u1')
+        if len(data)-header.end()<npixels*pixeltype.itemsize:
+            raise ValueError(f'Truncated PGM-file {name}')
+        image=np.frombuffer(data, dtype=pixeltype, count=npixels,
+                            offset=header.end())
+        if pixeltype.itemsize==1:
+            image=image.astype(np.uint16)
+        return image.reshape((height,width))
+
+    # ASCII data: ignore any comments and let NumPy do the number parsing
+    pixels=data[header.end():]
+    if b'#' in pixels:
+        pixels=_PGM_COMMENT.sub(b'', pixels)
+
+    if len(pixels.translate(None, _PGM_DIGITS))>0:
+        raise ValueError(f'Garbled pixel data in {name}')
+
+    # Parse into a wider type so that too large values are not wrapped
+    image=np.fromstring(pixels.decode('ascii'), dtype=np.int64, sep=' ')
+    if image.size!=npixels:
+        raise ValueError(f'Expected {npixels} pixels, but read {image.size} in {name}')
+    if image.max(initial=0)>maxval:
+        raise ValueError(f'Pixel values above the maximum grey value {maxval} in {name}')
+
+    return image.astype(np.uint16).reshape((height,width))
+
+
+#=================================================================
+
+def read_miss2(filename):
+    """
+    Read a MISS png-image, flip and rotate to have north up and increasing wavelength towards right.
+    """
+    missImage=np.array(Image.open(filename))
+
+    # The raw data has 1039 rows with 347 columns, do some flipping 
+    thisimage=np.fliplr(np.rot90(missImage))
+    
+    return thisimage
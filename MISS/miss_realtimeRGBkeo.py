@@ -5,6 +5,7 @@ Create a realtime RGB keogram from the past few hours
 """
 
 import datetime
+import os
 from os.path import isfile, join, basename
 
 #from glob import glob # It might be better to get an iterator?
@@ -15,67 +16,147 @@ import matplotlib.dates as mdates
 import datetime as dt
 from scipy import signal
 
+from miss_io import readpgm
+from miss_filter import filtered_lines
+
+
 #=================================================================
-# A user called Felix wrote a nice short reading routine for ASCII PGM-files
-# https://stackoverflow.com/questions/46944048/how-to-read-pgm-p2-image-in-python
+# From the raw image, these columns mark the northen and southern
+# horizon. This is used in extracting the values within the fied-of-view
+# of the instrument
+
+northcol=267
+southcol=70
+
+# Change the number of hours from 8 to whatever you prefer
+keominutes=8*60
+
+
+def extractlines(thisimage):
+    """
+    Process one raw image into the 557.7nm, 630.0nm and 427.8nm keogram
+    columns (from south to north)
+    """
+    # Bin the data if required (leftover from instrument tests...)
+    if(thisimage.shape==(1039,347)):
+        thisimage=thisimage[:-1,:].astype('float64') # Ignore the last column
+        thisimage=(thisimage[0::3,:]+thisimage[1::3,:]+thisimage[2::3,:])/3.0
+
+
+    # Process the image to filter noisy pixels out. Also,
+    # estimate the background from the side of the image and
+    # subtract that as well.
+    # Only the rows around the emission lines and the background
+    # corner are filtered.
+    band557, band630, band428=filtered_lines(thisimage, [159, 224, 34], axis=0)
+
+    datavals=np.linspace(southcol,northcol, num=180)
+
+    # The locations of the spectral lines and their
+    # backgrounds are from a vertically binned image (calibration...)
+    # New version: with 4-times CCD-binning in X-direction we should
+    #              sum three rows to get a 12-pixel binning in spectrum
+    #
+    # Note: the background determined near the spectral line needs more
+    #       work to look good (= do a better calibration)
+
+    #-----------------
+    # Process 557.7nm
+    
+    myline=band557
+    #mylinebg=thisimage[164,:]
 
-def readpgm(name):
-    with open(name) as f:
-        lines = f.readlines()
+    line557=np.interp(datavals,np.arange(0,len(myline)),myline)
+    #thislinebg=np.interp(datavals,np.arange(0,len(mylinebg)),mylinebg)
 
-    # Ignores commented lines
-    for l in list(lines):
-        if l[0] == '#':
-            lines.remove(l)
+    #-----------------
+    # Process 630.0nm
 
-    # Makes sure it is ASCII format (P2)
-    assert lines[0].strip() == 'P2', 'File not an ASCII PGM-file'
+    myline=band630
+    #mylinebg=thisimage[217,:]
 
-    # Converts data to a list of integers
-    data = []
-    for line in lines[1:]:
-        data.extend([int(c) for c in line.split()])
+    line630=np.interp(datavals,np.arange(0,len(myline)),myline)
+    #thislinebg=np.interp(datavals,np.arange(0,len(mylinebg)),mylinebg)
 
-    data=(np.array(data[3:]),(data[1],data[0]),data[2])
-    return np.reshape(data[0],data[1])
+    #------------------
+    # Process 427.8nm
+
+    myline=band428
+    #mylinebg=thisimage[36,:]
+
+    line428=np.interp(datavals,np.arange(0,len(myline)),myline)
+    #thislinebg=np.interp(datavals,np.arange(0,len(mylinebg)),mylinebg)
+
+    return line557, line630, line428
+
+
+#=================================================================
+# The processed keogram columns are kept in a ring buffer on disk, so that
+# each run only needs to process the images of the minutes that are still
+# empty, including images that arrive late. Each slot of the buffer holds the columns of one minute
+# (slot = minutes since 1970 modulo the keogram length) and the minute it
+# was filled for, which tells whether the slot is still within the window.
+
+def epochminute(mytime):
+    return (mytime-dt.datetime(1970,1,1))//dt.timedelta(minutes=1)
+
+
+def loadstate(statefile):
+    """
+    Returns (slotminutes, keo) from the state file or an empty state if
+    there is no usable state file
+    """
+    if statefile is not None and isfile(statefile):
+        try:
+            with np.load(statefile) as state:
+                if state['keo'].shape==(3,180,keominutes):
+                    return state['slotminutes'], state['keo']
+        except Exception as error:
+            print('Could not read', statefile)
+            print(error)
+
+    return np.full(keominutes,-1,dtype=np.int64), np.zeros((3,180,keominutes))
+
+
+def savestate(statefile, slotminutes, keo):
+    # Replace the old state only once the new one is completely written
+    tmpfile=statefile+'.tmp'
+    with open(tmpfile,'wb') as f:
+        np.savez(f, slotminutes=slotminutes, keo=keo)
+    os.replace(tmpfile,statefile)
 
 
 #=================================================================
 # Create a keogram from the last X hours of data
 # - search for matching files based on the current time
-
-def createkeogram(basepath, savefilename):
+# - with a state file, only the minutes without a processed file are
+#   searched for, so files that arrive late are still picked up
+
+def listpgms(dirpath):
+    """
+    The names of the MISS-*.pgm files in a directory (empty if there is no
+    such directory)
+    """
+    try:
+        with os.scandir(dirpath) as entries:
+            return {entry.name for entry in entries
+                    if entry.name.startswith('MISS-') and entry.name.endswith('.pgm')}
+    except FileNotFoundError:
+        return set()
+
+
+def createkeogram(basepath, savefilename, statefile=None):
     # Ignore the last five minutes of data to ensure that
     # there is data. Align to whole minutes.
     latest=dt.datetime.utcnow()-dt.timedelta(minutes=5)
     latest=latest.replace(second=0, microsecond=0)
+    latestminute=epochminute(latest)
 
-    # Change the number of hours from 8 to whatever you prefer
-    datapoints=[latest-dt.timedelta(minutes=x) for x in range(0,8*60)]
-
-    myfiles=[]
-
-    # Search for data
-    for myfile in datapoints:
-        dirpath=join(myfile.strftime('%Y'),myfile.strftime('%m'),myfile.strftime('%d'))
-        filename=myfile.strftime('MISS-%Y%m%d-%H%M00.pgm')
-        filepath=join(basepath,dirpath,filename)
-        if(isfile(filepath)==True):
-           #print(filepath)
-           myfiles.append(filepath)
-
-    if(len(myfiles)==0):
-        return
+    datapoints=[latest-dt.timedelta(minutes=x) for x in range(0,keominutes)]
 
-    #-------------------------------------------------------------
-    # Prepare empty keograms to be filled by processing all files
+    slotminutes, keo=loadstate(statefile)
 
-    keo557=np.zeros((180,24*60))
-    keo630=np.zeros((180,24*60))
-    keo428=np.zeros((180,24*60))
-
-
-    # Process all files
+    # Process all new files
     # Expect the filename to be of correct format with the year,
     # month and day encoded in fixed locations
     #
@@ -84,88 +165,54 @@ def createkeogram(basepath, savefilename):
     # MISS-20181007-000000.pgm
     # MISS-%Y%m%d-%H%M%S.pgm
 
-    # From the raw image, these columns mark the northen and southern
-    # horizon. This is used in extracting the values within the fied-of-view
-    # of the instrument
-
-    northcol=267
-    southcol=70
-
     # For each file
     # - read the raw file
     # - extract spectral line with an associated background
     # - remove the background values
     # - collect the values into a time vs. latitude plot (keogram)
-    
-    
-    for thisfile in myfiles:
-        thisbasename=basename(thisfile)
-        thisfiletime=datetime.datetime.strptime(thisbasename,'MISS-%Y%m%d-%H%M%S.pgm')
-        if (thisfiletime.second != 0):
+    #
+    # The day directories of the window are listed once, instead of
+    # checking each minute for a file
+
+    daynames={}
+    for myfile in datapoints:
+        dirpath=join(myfile.strftime('%Y'),myfile.strftime('%m'),myfile.strftime('%d'))
+        if dirpath not in daynames:
+            daynames[dirpath]=listpgms(join(basepath,dirpath))
+
+    for x, myfile in enumerate(datapoints):
+        thisminute=latestminute-x
+        slot=thisminute%keominutes
+        if slotminutes[slot]==thisminute:
+            continue # The file was processed in an earlier run
+
+        dirpath=join(myfile.strftime('%Y'),myfile.strftime('%m'),myfile.strftime('%d'))
+        thisbasename=myfile.strftime('MISS-%Y%m%d-%H%M00.pgm')
+        if thisbasename not in daynames[dirpath]:
             continue
+        thisfile=join(basepath,dirpath,thisbasename)
 
         try:
             thisimage=readpgm(thisfile)
+            keo[:,:,slot]=extractlines(thisimage)
+            slotminutes[slot]=thisminute
+            print('     ',thisbasename, slot)
+        except:
+            print('Could not process', thisfile)
 
-            # Bin the data if required (leftover from instrument tests...)
-            if(thisimage.shape==(1039,347)):
-                thisimage=thisimage[:-1,:] # Ignore the last column
-                thisimage=(thisimage[0::3,:]+thisimage[1::3,:]+thisimage[2::3,:])/3.0
-
-
-            # Process the image to filter noisy pixels out. Also,
-            # estimate the background from the side of the image and
-            # subtract that as well.
-            thisimage=signal.medfilt2d(thisimage.astype('float32'))
-            bg=np.average(thisimage[0:30,0:30])
-            thisimage=np.maximum(0,thisimage-bg)
-            
-            delta=latest-thisfiletime
-            index=24*60-1-round(delta.seconds/60)-24*60*delta.days
-            print('     ',thisbasename, delta, delta.seconds,index)
-
-            datavals=np.linspace(southcol,northcol, num=180)
-
-            # The locations of the spectral lines and their
-            # backgrounds are from a vertically binned image (calibration...)
-            # New version: with 4-times CCD-binning in X-direction we should
-            #              sum three rows to get a 12-pixel binning in spectrum
-            #
-            # Note: the background determined near the spectral line needs more
-            #       work to look good (= do a better calibration)
-
-            #-----------------
-            # Process 557.7nm
-            
-            myline=thisimage[159,:]+thisimage[158,:]+thisimage[160,:]
-            #mylinebg=thisimage[164,:]
-
-            thisline=np.interp(datavals,np.arange(0,len(myline)),myline)
-            #thislinebg=np.interp(datavals,np.arange(0,len(mylinebg)),mylinebg)
-            keo557[:,index]=thisline #np.maximum(thisline-thislinebg,0)
-
-            #-----------------
-            # Process 630.0nm
-    
-            myline=thisimage[224,:]+thisimage[223,:]+thisimage[225,:]
-            #mylinebg=thisimage[217,:]
-
-            thisline=np.interp(datavals,np.arange(0,len(myline)),myline)
-            #thislinebg=np.interp(datavals,np.arange(0,len(mylinebg)),mylinebg)
-            keo630[:,index]=thisline #np.maximum(thisline-thislinebg,0)
+    if statefile is not None:
+        savestate(statefile, slotminutes, keo)
 
-            #------------------
-            # Process 427.8nm
-    
-            myline=thisimage[34,:]+thisimage[33,:]+thisimage[35,:]
-            #mylinebg=thisimage[36,:]
+    # Arrange the columns from the oldest to the latest minute and
+    # leave out anything that has dropped out of the window
 
-            thisline=np.interp(datavals,np.arange(0,len(myline)),myline)
-            #thislinebg=np.interp(datavals,np.arange(0,len(mylinebg)),mylinebg)
-            keo428[:,index]=thisline #np.maximum(thisline-thislinebg,0)
-        except:
-            print('Could not process', thisfile)
+    windowminutes=np.arange(latestminute-keominutes+1,latestminute+1)
+    slots=windowminutes%keominutes
+    valid=slotminutes[slots]==windowminutes
+    if valid.any()==False:
+        return
 
+    keo557, keo630, keo428=np.where(valid, keo[:,:,slots], 0)
 
     fig, (ax3) = plt.subplots(1,1)
     ax3.set_title('Meridian Imaging Spectrograph in Svalbard (KHO/UNIS) \n'+
@@ -187,7 +234,7 @@ def createkeogram(basepath, savefilename):
     # RGB composite
     # - the constants were manually "tuned"
     
-    rgbkeo=np.zeros((180,24*60,3))
+    rgbkeo=np.zeros((180,keominutes,3))
     rgbkeo[...,0]=np.sqrt(np.minimum(1,keo630/1500.0))
     rgbkeo[...,1]=np.sqrt(np.minimum(1,keo557/3000.0))
     rgbkeo[...,2]=np.sqrt(np.minimum(1,keo428/1000.0))
@@ -212,6 +259,7 @@ def createkeogram(basepath, savefilename):
     # Store the summary plot into monthly directories
 
     plt.savefig(savefilename,dpi=mydpi)
+    plt.close(fig)
     print('Stored ' + savefilename)
 
 # For development, it's convenient to have the data stored...
@@ -224,9 +272,13 @@ def createkeogram(basepath, savefilename):
 #======================================================================
 
 
-basepath='C:\\Users\\mikkos\MISS'
+if __name__ == "__main__":
+    basepath='C:\\Users\\mikkos\MISS'
+
+    webbase='Z:\\kho\\MISS'
+    webfile=join(webbase,'miss-keo24hours.png')
 
-webbase='Z:\\kho\\MISS'
-webfile=join(webbase,'miss-keo24hours.png')
+    # The processed keogram columns are kept between the runs
+    statefile=join(basepath,'miss-keo-state.npz')
 
-createkeogram(basepath,webfile)
+    createkeogram(basepath,webfile,statefile)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Stream movie frames to ffmpeg through a pipe
+
+The frames of the daily movies used to be saved as JPEGs in /dev/shm and
+read back by ffmpeg, twice for a two-pass encoding. Here the frames are
+given to ffmpeg as raw RGB (rawvideo) on its standard input instead, so
+they are not compressed and decompressed in between and nothing has to be
+cleaned up afterwards.
+
+A two-pass encoding needs the frames twice. The first pass runs while the
+frames are written, and the frames are also stored into a memory-mapped
+raw file (cachefile), from which they are piped again for the second pass.
+The cache file takes nframes*height*width*3 bytes (about 5 GB for 7200
+frames of 480x480) and is removed when the movie is ready.
+
+Example:
+
+    with MovieWriter('20230101_unis_kho_sony-rgb.mp4', (480,480), 7200,
+                     cachefile='/Data/Scratch/frames.raw') as movie:
+        for frame in frames:
+            movie.write(frame)
+
+"""
+
+import os
+import subprocess
+
+import numpy as np
+
+
+class MovieWriter:
+    """
+    An H.264 movie encoded by ffmpeg from RGB frames
+    """
+
+    def __init__(self, filename, size, nframes=None, framerate=15, bitrate='300k',
+                 cachefile=None, ffmpeg='ffmpeg'):
+        """
+        filename  - the movie file
+        size      - (height, width) of the frames
+        nframes   - the number of frames, needed for the two-pass encoding
+        framerate - frames per second of the movie
+        bitrate   - the target bitrate of ffmpeg (-b:v), or None for the
+                    default quality of libx264
+        cachefile - the raw frame file of a two-pass encoding, without it
+                    the movie is encoded in one pass
+        ffmpeg    - the ffmpeg executable
+        """
+        self.filename=filename
+        self.size=size
+        self.nframes=nframes
+        self.framerate=framerate
+        self.bitrate=bitrate
+        self.cachefile=cachefile
+        self.ffmpeg=ffmpeg
+        self.count=0
+
+        self.cache=None
+        if cachefile is not None:
+            if nframes is None:
+                raise ValueError('The number of frames is needed for the two-pass encoding')
+            self.cache=np.memmap(cachefile, dtype=np.uint8, mode='w+', shape=(nframes,*size,3))
+            self.passlogfile=os.path.splitext(cachefile)[0]+'-ffmpeg2pass'
+            self.process=self._start(1)
+        else:
+            self.process=self._start(None)
+
+    def _command(self, encodingpass):
+        """
+        The ffmpeg command of a pass (1 or 2, None for a single pass)
+        """
+        height, width=self.size
+        command=[self.ffmpeg, '-y', '-loglevel', 'error',
+                 '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}',
+                 '-framerate', str(self.framerate), '-i', '-',
+                 '-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+        if self.bitrate is not None:
+            command+=['-b:v', self.bitrate]
+        if encodingpass is None:
+            return command+[self.filename]
+
+        command+=['-pass', str(encodingpass), '-passlogfile', self.passlogfile]
+        if encodingpass==1:
+            return command+['-an', '-f', 'null', os.devnull]
+        return command+[self.filename]
+
+    def _start(self, encodingpass):
+        return subprocess.Popen(self._command(encodingpass), stdin=subprocess.PIPE, bufsize=0)
+
+    def _finish(self, process):
+        process.stdin.close()
+        if process.wait()!=0:
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+
+    def write(self, frame):
+        """
+        Add a frame, a (height, width, 3) uint8 RGB array
+        """
+        frame=np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.shape!=(*self.size,3):
+            raise ValueError(f'Frame of shape {frame.shape}, expected {(*self.size,3)}')
+        if self.cache is not None:
+            if self.count>=self.nframes:
+                raise ValueError(f'More than {self.nframes} frames')
+            self.cache[self.count]=frame
+
+        self.process.stdin.write(frame.data)
+        self.count+=1
+
+    def close(self):
+        """
+        Finish the movie: the single pass, or both passes of a two-pass
+        encoding. The cache and log files are removed.
+        """
+        if self.process is None:
+            return
+        try:
+            self._finish(self.process)
+            if self.cache is not None:
+                self.process=self._start(2)
+                for frame in self.cache[:self.count]:
+                    self.process.stdin.write(frame.data)
+                self._finish(self.process)
+        finally:
+            self.process=None
+            self._cleanup()
+
+    def _cleanup(self):
+        if self.cache is None:
+            return
+        del self.cache
+        self.cache=None
+        for filename in [self.cachefile, self.passlogfile+'-0.log', self.passlogfile+'-0.log.mbtree']:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Do not leave a half-written movie or the cache behind
+            if self.process is not None:
+                self.process.kill()
+                self.process.wait()
+                self.process=None
+            self._cleanup()
+            if os.path.isfile(self.filename):
+                os.remove(self.filename)
@@ -27,9 +27,13 @@ import numpy as np
 import os
 import re
 import datetime as dt
+import sys
 from PIL import Image, ImageDraw, ImageFont
 #import cv2
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from archive_index import ArchiveIndex
+
 def oneDayThumbnails(year,month,day,overWriteExisting=False):
     #keoname=f'LYR-KHO-{year}{month:02}{day:02}.jpg'
 #    if os.path.isfile(keoname)==True:
@@ -143,12 +147,19 @@ def oneDayThumbnails(year,month,day,overWriteExisting=False):
 
 #oneDayThumbnails(2022,2,4)
 
-years=(2017,) #2018,2019,2020)
-months=(1,) #2,11,12) #,11,12)
-for year in years:
-    for month in months:
-        for day in np.arange(1,2):
-            oneDayThumbnails(year, month, day,overWriteExisting=False)
+if __name__ == "__main__":
+    # The archive index lists the days that actually have images, so the
+    # days without data are not probed one by one
+    sonypath=os.path.join("D:\\","KHO","Sony")
+    with ArchiveIndex(os.path.join(sonypath,'archive-index.sqlite')) as index:
+        index.refresh(sonypath)
+        days=index.days('Sony-DDMMYY')
+
+    years=(2017,) #2018,2019,2020)
+    months=(1,) #2,11,12) #,11,12)
+    for myday in days:
+        if myday.year in years and myday.month in months and myday.day<2:
+            oneDayThumbnails(myday.year, myday.month, myday.day,overWriteExisting=False)
 
 #years=(2016,2017,2018,2019,2020,2021,2022,2023,2024)
 #months=(1,2,11,12)
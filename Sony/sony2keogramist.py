@@ -4,115 +4,217 @@ from datetime import datetime, timedelta
 from PIL import Image
 import shutil
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-dataYear = 2023
-cadence=12 # seconds, either 10s or 12s depending on the year
-
-if cadence==12:
-    totalframes=7200
-if cadence==10:
-    totalframes=8640
-
-for dataMonth in range(1, 2):
-    for dataDay in range(1,32):
-        ts = None
-        start_time = time.time()
-        
-        imgpath = os.path.join('/Data',  'Quicklooks', str(dataYear), 
-                               f'{dataMonth:02d}', f'{dataDay:02d}')
-        if not os.path.exists(imgpath):
-            continue
-        
-        img_files = [f for f in os.listdir(imgpath) if f.endswith('.jpg')]
-        
-        auroraxpath = os.path.join('/Data', 'AuroraX', 'unis', 'kho_sony', 
-                                   str(dataYear), f'{dataMonth:02d}', f'{dataDay:02d}')
-        
-        if os.path.exists(auroraxpath):
-            print(f'Data exists, skipping {auroraxpath}')
-            continue
-
-        os.makedirs(auroraxpath)
-        
-        framepath = os.path.join('/dev/shm/Frames') #auroraxpath, 'Frames')
-        if not os.path.exists(framepath):
-            os.makedirs(framepath)
-        
-        N = len(img_files)
-        
-        if ts is None:
-            print('Creating timelist...')
-            ts = np.full(N, np.nan)
-            
-            for i, filename in enumerate(img_files):
-                # Parse the filename for timestamp info
-                year = filename[9:13]
-                month = filename[13:15]
-                day = filename[15:17]
-                hh = filename[18:20]
-                mm = filename[20:22]
-                ss = filename[22:24]
-                
-                if i % 100 == 0:
-                    timecaption = f'{year}-{month}-{day} {hh}:{mm}:{ss} UT'
-                    print(f' - {i} {timecaption}')
-                    time.sleep(0.01)
-                
-                ts[i] = int(hh) * 3600 + int(mm) * 60 + int(ss)
-            
-            print('Timelist ready!')
-        
-        print('Creating keogram...')
-        keogram = 255*np.ones((480, totalframes, 3), dtype=np.uint8)  # Empty white keogram
-        
-        ephname = os.path.join(auroraxpath, f'ephemeris_kho_sony_{dataYear}{dataMonth:02d}{dataDay:02d}.txt')
-        
-        with open(ephname, 'w') as fileID:
-            fileID.write('# program: UNIS/KHO\n')
-            fileID.write('# platform: Longyearbyen\n')
-            fileID.write('# instrument_type: colour ASI\n')
-            fileID.write('# geo_lat: 78.148\n')
-            fileID.write('# geo_lon: 16.043\n')
-            fileID.write('timestamp\n')
-            
-            startOfDay = datetime(dataYear, dataMonth, dataDay, 0, 0, 0)
-            
-            # 12-s intervals = 5 images/minute -> 5*60*24=7200 images per day
-            # 10-s intervals = 6 images/minute -> 6*60*24=8640 images per day
-
-            for thistime in range(totalframes):  # 0 to 7199 (for each 12 seconds)
-                thisseconds = thistime * cadence  # Each time slot corresponds to 10 or 12 seconds
-                deltas = np.abs(thisseconds - ts)
-                min_delta, ind = np.min(deltas), np.argmin(deltas)
-                
-                thisframe = 255*np.ones((480, 480, 3), dtype=np.uint8) # Empty white videoframe
-                if min_delta < 20:
-                    # Read the image corresponding to the minimum delta
+from movie_writer import MovieWriter
+
+# An image is used for a time slot only if it is closer than this (seconds)
+maxgap=20
+
+
+def image_seconds(img_files):
+    """
+    The time of day (seconds) of each image from the file names
+    LYR-Sony-YYYYMMDD_HHMMSS.jpg
+    """
+    ts = np.full(len(img_files), np.nan)
+
+    for i, filename in enumerate(img_files):
+        # Parse the filename for timestamp info
+        year = filename[9:13]
+        month = filename[13:15]
+        day = filename[15:17]
+        hh = filename[18:20]
+        mm = filename[20:22]
+        ss = filename[22:24]
+
+        if i % 100 == 0:
+            timecaption = f'{year}-{month}-{day} {hh}:{mm}:{ss} UT'
+            print(f' - {i} {timecaption}')
+
+        ts[i] = int(hh) * 3600 + int(mm) * 60 + int(ss)
+
+    return ts
+
+
+def match_slots(ts, totalframes, cadence, maxgap=maxgap):
+    """
+    The image closest in time to each slot 0, cadence, 2*cadence, ...
+    seconds. ts are the image times in seconds. Returns the index of the
+    image for each slot, or -1 if no image is closer than maxgap seconds.
+    Of two images equally close, the earlier one is used.
+
+    The images are sorted by time once, so each slot only compares the
+    images just before and after it (searchsorted) instead of all images
+    of the day.
+    """
+    if len(ts) == 0:
+        return np.full(totalframes, -1)
+
+    order = np.argsort(ts, kind='stable')
+    sortedts = ts[order]
+    slots = np.arange(totalframes) * cadence
+
+    # The first image at or after each slot, and the first one of the
+    # images with the time just before it
+    after = np.searchsorted(sortedts, slots)
+    before = np.searchsorted(sortedts, sortedts[np.maximum(after - 1, 0)])
+    after = np.minimum(after, len(ts) - 1)
+
+    deltabefore = np.abs(slots - sortedts[before])
+    deltaafter = np.abs(sortedts[after] - slots)
+    nearest = np.where(deltaafter < deltabefore, after, before)
+    delta = np.abs(slots - sortedts[nearest])
+
+    # NaN times (compared as False) never match
+    return np.where(delta < maxgap, order[nearest], -1)
+
+
+def read_image(filename):
+    """
+    The image as a uint8 RGB array
+    """
+    with Image.open(filename) as im:
+        return np.asarray(im.convert('RGB'))
+
+
+def prefetch_images(filenames, workers=8, prefetch=32):
+    """
+    Yield the images of filenames in order, decoded by a pool of threads.
+    At most prefetch images are decoded ahead of the one being used, so
+    the memory use is bounded. PIL releases the GIL while decoding, so the
+    threads run on several cores.
+    """
+    filenames = iter(filenames)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for filename in filenames:
+            pending.append(pool.submit(read_image, filename))
+            if len(pending) >= prefetch:
+                break
+
+        while pending:
+            image = pending.popleft().result()
+            filename = next(filenames, None)
+            if filename is not None:
+                pending.append(pool.submit(read_image, filename))
+            yield image
+
+
+def keogramist_day(dataYear, dataMonth, dataDay, cadence, cachepath=None,
+                   workers=8, prefetch=32):
+    """
+    The keogram, movie and ephemeris of one day for AuroraX. The frames of
+    the movie are piped to ffmpeg, and with a cachepath they are also
+    cached there for a two-pass encoding (see movie_writer.py). The images
+    are decoded by workers threads, at most prefetch images ahead.
+    """
+    # 12-s intervals = 5 images/minute -> 5*60*24=7200 images per day
+    # 10-s intervals = 6 images/minute -> 6*60*24=8640 images per day
+    totalframes = 24 * 3600 // cadence
+
+    start_time = time.time()
+
+    imgpath = os.path.join('/Data',  'Quicklooks', str(dataYear),
+                           f'{dataMonth:02d}', f'{dataDay:02d}')
+    if not os.path.exists(imgpath):
+        return
+
+    img_files = sorted(f for f in os.listdir(imgpath) if f.endswith('.jpg'))
+
+    auroraxpath = os.path.join('/Data', 'AuroraX', 'unis', 'kho_sony',
+                               str(dataYear), f'{dataMonth:02d}', f'{dataDay:02d}')
+
+    if os.path.exists(auroraxpath):
+        print(f'Data exists, skipping {auroraxpath}')
+        return
+
+    os.makedirs(auroraxpath)
+
+    print('Creating timelist...')
+    ts = image_seconds(img_files)
+    slotimages = match_slots(ts, totalframes, cadence)
+    print('Timelist ready!')
+
+    print('Creating keogram...')
+    keogram = 255*np.ones((480, totalframes, 3), dtype=np.uint8)  # Empty white keogram
+    emptyframe = 255*np.ones((480, 480, 3), dtype=np.uint8) # Empty white videoframe
+
+    mp4name = os.path.join(auroraxpath, f'{dataYear}{dataMonth:02d}{dataDay:02d}_unis_kho_sony-rgb.mp4')
+    cachefile = None
+    if cachepath is not None:
+        cachefile = os.path.join(cachepath, f'frames-{dataYear}{dataMonth:02d}{dataDay:02d}.raw')
+
+    ephname = os.path.join(auroraxpath, f'ephemeris_kho_sony_{dataYear}{dataMonth:02d}{dataDay:02d}.txt')
+
+    with open(ephname, 'w') as fileID, MovieWriter(mp4name, (480, 480), totalframes,
+                                                   cachefile=cachefile) as movie:
+        fileID.write('# program: UNIS/KHO\n')
+        fileID.write('# platform: Longyearbyen\n')
+        fileID.write('# instrument_type: colour ASI\n')
+        fileID.write('# geo_lat: 78.148\n')
+        fileID.write('# geo_lon: 16.043\n')
+        fileID.write('timestamp\n')
+
+        startOfDay = datetime(dataYear, dataMonth, dataDay, 0, 0, 0)
+
+        # The slots of the same image follow each other, so each image is
+        # decoded only once for the keogram, the frames and the ephemeris.
+        # The images are decoded ahead in the order they are used.
+        used = slotimages[slotimages >= 0]
+        used = used[np.diff(used, prepend=-1) != 0]
+        images = prefetch_images((os.path.join(imgpath, img_files[i]) for i in used),
+                                 workers, prefetch)
+        ind = -1
+        for thistime in range(totalframes):
+            thisseconds = thistime * cadence  # Each time slot corresponds to 10 or 12 seconds
+
+            thisframe = emptyframe
+            if slotimages[thistime] >= 0:
+                if slotimages[thistime] != ind:
+                    ind = slotimages[thistime]
                     filename = img_files[ind]
-                    img = np.array(Image.open(os.path.join(imgpath, filename)), dtype=np.float64)
-                    keogram[:, thistime, :] = img[:, 240, :]  # N-S slice
-                    
-                    mytime = startOfDay + timedelta(seconds=thisseconds)
-                    mytimestamp = mytime.strftime('%Y-%m-%dT%H:%M:%S')
-                    fileID.write(f'{mytimestamp}\n')
-                    
-                    thisframe = img
-                    
-                    if thistime % 100 == 0:
-                        print(f'{thistime}\t{mytimestamp}\t{filename}')
-                
-                framename = os.path.join(framepath, f'frame{thistime:04d}.jpg')
-                Image.fromarray(np.uint8(thisframe)).save(framename)
-        
-        # Save keogram
-        keoname = os.path.join(auroraxpath, f'{dataYear}{dataMonth:02d}{dataDay:02d}__kho_sony_hires-keogram.jpg')
-        Image.fromarray(keogram).save(keoname)
-        
-        mp4name = os.path.join(auroraxpath, f'{dataYear}{dataMonth:02d}{dataDay:02d}_unis_kho_sony-rgb.mp4')
-
-        os.system(f'/home/mikkos/bin/createMovie2pass.sh {mp4name}')
-        os.system('rm -rf /dev/shm/Frames')
-        #os.system('rm ffmpeg2pass*.log*')
-        elapsed_time = time.time() - start_time
-        print(f'Time taken: {elapsed_time:.2f} seconds')
+                    img = next(images)
+                keogram[:, thistime, :] = img[:, 240, :]  # N-S slice
+
+                mytime = startOfDay + timedelta(seconds=thisseconds)
+                mytimestamp = mytime.strftime('%Y-%m-%dT%H:%M:%S')
+                fileID.write(f'{mytimestamp}\n')
+
+                thisframe = img
+
+                if thistime % 100 == 0:
+                    print(f'{thistime}\t{mytimestamp}\t{filename}')
+
+            movie.write(thisframe)
+
+    # Save keogram
+    keoname = os.path.join(auroraxpath, f'{dataYear}{dataMonth:02d}{dataDay:02d}__kho_sony_hires-keogram.jpg')
+    Image.fromarray(keogram).save(keoname)
+
+    elapsed_time = time.time() - start_time
+    print(f'Time taken: {elapsed_time:.2f} seconds')
+
+
+#======================================================================
+
+if __name__ == "__main__":
+
+    dataYear = 2023
+    cadence=12 # seconds, either 10s or 12s depending on the year
+
+    # The raw frames of the two-pass encoding are cached here, about 5 GB
+    # per day (set to None to encode the movies in one pass)
+    cachepath = os.path.join('/Data', 'Scratch')
+    if cachepath is not None:
+        os.makedirs(cachepath, exist_ok=True)
+
+    # The number of threads decoding the images and how many images they
+    # may decode ahead
+    workers = 16
+    prefetch = 64
 
+    for dataMonth in range(1, 2):
+        for dataDay in range(1,32):
+            keogramist_day(dataYear, dataMonth, dataDay, cadence, cachepath, workers, prefetch)
@@ -11,12 +11,21 @@ images for evaluating the cloudyness in the sky.
 
 
 
+import datetime as dt
 import glob
 import numpy as np
 import os
 import shutil
+import sys
 
-def oneDayPruning(year,month,day):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from archive_index import ArchiveIndex
+
+def oneDayPruning(year,month,day,index=None):
+    """
+    Copy the first image of each hour. The images are looked up from the
+    archive index if one is given, otherwise with a glob for each hour.
+    """
     basepath=os.path.join("D:\\","KHO","Sony","Quicklooks",
                           f'{year:04}', f'{month:02}',f'{day:02}')
 
@@ -25,10 +34,19 @@ def oneDayPruning(year,month,day):
 
     print(targetpath)
 
+    if index is not None:
+        myday=dt.date(year,month,day)
+        dayfiles=index.files('Sony',myday,myday+dt.timedelta(days=1))
+        if len(dayfiles)==0:
+            return
+
     for hh in np.arange(0,24):
-        filename=f'LYR-Sony-{year:04}{month:02}{day:02}_{hh:02}*.jpg'
-        imagefiles=glob.glob(os.path.join(basepath,filename))
-        imagefiles.sort()
+        if index is not None:
+            imagefiles=[path for filetime, path in dayfiles if filetime.hour==hh]
+        else:
+            filename=f'LYR-Sony-{year:04}{month:02}{day:02}_{hh:02}*.jpg'
+            imagefiles=glob.glob(os.path.join(basepath,filename))
+            imagefiles.sort()
         if len(imagefiles)>=1:
             oneFile=imagefiles[0]
             oneFileBase=os.path.basename(oneFile)
@@ -51,10 +69,14 @@ def oneDayPruning(year,month,day):
 # =================================================================
 
 
-year=2018
-for month in np.arange(1,13):
-    for day in np.arange(1,31):
-        oneDayPruning(year,month,day)
+if __name__ == "__main__":
+    quicklookpath=os.path.join("D:\\","KHO","Sony","Quicklooks")
+    with ArchiveIndex(os.path.join(quicklookpath,'archive-index.sqlite')) as index:
+        index.refresh(quicklookpath)
+        year=2018
+        for myday in index.days('Sony'):
+            if myday.year==year and myday.day<31:
+                oneDayPruning(myday.year,myday.month,myday.day,index)
 
 
 # years=(2018,2019,2020,2021,2022,2023,2024)
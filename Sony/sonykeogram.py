@@ -16,9 +16,88 @@ import datetime as dt
 from PIL import Image
 import matplotlib.pyplot as plt
 import shutil
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from archive_index import ArchiveIndex
+from keogram_raster import RasterKeogram
+from figure_template import FigureTemplate
 
-def keogramOneDaySony(year,month,day):
+
+def keogram_figure(keogram, titleDate):
+    """
+    The figure of the keogram of one day (flipped upside down and scaled
+    to 0...1)
+    """
+    fig, (ax) = plt.subplots(1,1)
+    pngwidth=1200
+    pngheight=800
+    mydpi=100
+    fig.set_size_inches(pngwidth/mydpi,pngheight/mydpi)
+
+    ax.set_xlabel('Time (UT)')
+    ax.set_ylabel('Zenith angle')
+    plt.sca(ax)
+
+    plt.xticks(np.arange(0,24,1)*60,np.arange(0,24,1))
+    ax.set_ylim(ymax=670)
+    # Ticks every 30 degrees
+    ss=670/180*30
+    plt.yticks(np.arange(0,670+1,step=ss),['South',-60,-30,'Zenith',30,60,'North'])
+
+    ax.set_title(f'KHO/UNIS Sony A7S {titleDate}', fontsize=14)
+
+    ax.imshow(keogram, aspect='auto')
+
+    fig.tight_layout()
+    #plt.show()
+    return fig
+
+
+# The renderers are created once in each process
+_renderers={}
+
+def keogram_renderer(raster=True):
+    """
+    The renderer of the daily keograms: the raster renderer (see
+    keogram_raster.py) or the Matplotlib figure reused for each keogram
+    (see figure_template.py)
+    """
+    if raster not in _renderers:
+        if raster:
+            _renderers[raster]=RasterKeogram(keogram_figure, (670,24*60,3), '0000-00-00')
+        else:
+            _renderers[raster]=FigureTemplate(keogram_figure(np.zeros((670,24*60,3)), '0000-00-00'),
+                                              '0000-00-00', dpi=100)
+    return _renderers[raster]
+
+
+def meridian_strip(imagefile, size=(700,700), column=350, rows=(22,692), draft=False):
+    """
+    The meridional slice of an image as uint8 RGB, rows[0]...rows[1]-1 of
+    the column of the image resized to size, i.e.
+    np.asarray(Image.open(imagefile).resize(size))[rows[0]:rows[1],column,:]
+    up to rounding by one count.
+
+    Only the strip is resampled (with the same bicubic filter), by giving
+    the area of the column as the box of resize, which takes about half of
+    the time of resizing the full image. With draft=True the JPEG is also
+    decoded directly at 1/2, 1/4 or 1/8 of its size, as long as it stays at
+    least as large as size, which is faster still. The values then differ
+    from the full image, by more than 10 counts in textured images, so the
+    keograms rebuilt with draft=True do not match the archived ones.
+    """
+    with Image.open(imagefile) as im:
+        if draft:
+            im.draft('RGB', size)
+        width, height=im.size
+        box=(column*width/size[0], rows[0]*height/size[1],
+             (column+1)*width/size[0], rows[1]*height/size[1])
+        strip=im.convert('RGB').resize((1, rows[1]-rows[0]), Image.Resampling.BICUBIC, box=box)
+    return np.asarray(strip)[:,0,:]
+
+
+def keogramOneDaySony(year,month,day,renderer=None):
     monthpath=os.path.join('/','home','mikkos','Data',f'{year:04}',f'{month:02}')
     daypath=os.path.join(monthpath,f'{day:02}')
 
@@ -94,8 +173,7 @@ def keogramOneDaySony(year,month,day):
         # The following should probably be replaced with a code that only takes
         # the slice *inside* of the field-of-view.
         try:
-            im=np.asarray(Image.open(imagefiles[i]).resize((700,700)))
-            slice=im[22:692,350,:]
+            slice=meridian_strip(imagefiles[i])
         except:
             print('Problems with',thisfile)
             continue
@@ -105,30 +183,12 @@ def keogramOneDaySony(year,month,day):
         filesread=filesread+1
 
 
-    fig, (ax) = plt.subplots(1,1)
-    pngwidth=1200
-    pngheight=800
-    mydpi=100
-    fig.set_size_inches(pngwidth/mydpi,pngheight/mydpi)
-
-    ax.set_xlabel('Time (UT)')
-    ax.set_ylabel('Zenith angle')
-    plt.sca(ax)
-
-    plt.xticks(np.arange(0,24,1)*60,np.arange(0,24,1))
-    ax.set_ylim(ymax=670)
-    # Ticks every 30 degrees
-    ss=670/180*30
-    plt.yticks(np.arange(0,670+1,step=ss),['South',-60,-30,'Zenith',30,60,'North'])
-
-    ax.set_title(f'KHO/UNIS Sony A7S {year}-{month:02}-{day:02}', fontsize=14)
-
-    ax.imshow(np.flipud(keogram/255), aspect='auto')
-
-    fig.tight_layout()
-    #plt.show()
-
-    plt.savefig(keoname, dpi=mydpi)
+    # The raster renderer draws the same layout faster, otherwise the
+    # Matplotlib figure of the process is reused
+    titleDate=f'{year}-{month:02}-{day:02}'
+    if renderer is None:
+        renderer=keogram_renderer(raster=False)
+    renderer.render(np.flipud(keogram/255), keoname, titleDate)
 
     # Copy to web
     if os.path.isfile(webname)==True:
@@ -148,13 +208,22 @@ def keogramOneDaySony(year,month,day):
 #year=2024
 #month=10
 
-mydt=dt.datetime.now(dt.UTC)
-
-for i in range(1,15):
-    checkdt=mydt-dt.timedelta(days=i)
-    year=checkdt.year
-    month=checkdt.month
-    day=checkdt.day
-    keogramOneDaySony(year,month,day)
+if __name__ == "__main__":
+    # Only days with images but without a keogram need any work, which the
+    # archive index tells without listing every directory
+    datapath=os.path.join('/','home','mikkos','Data')
+    with ArchiveIndex(os.path.join(datapath,'archive-index.sqlite')) as index:
+        index.refresh(datapath)
+        missingdays=set(index.missing_days('Sony','Sony-keogram'))
 
+    mydt=dt.datetime.now(dt.UTC)
+    renderer=keogram_renderer()
 
+    for i in range(1,15):
+        checkdt=mydt-dt.timedelta(days=i)
+        if checkdt.date() not in missingdays:
+            continue
+        year=checkdt.year
+        month=checkdt.month
+        day=checkdt.day
+        keogramOneDaySony(year,month,day,renderer)
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+A catalogue of the spectrometer .lyr-files at KHO
+
+Finding out which days, setups and wavelength ranges exist in the
+saasdata directories otherwise means parsing every file. Instead, the scan
+headers of each file are read once (see read_lyr_headers, the data points
+are not converted) and summarised into an SQLite database:
+
+    files   the time of the first and last scan and the number of scans
+            of each file, or the error if the file could not be read
+    setups  for each setup of a file the number of scans, the time range,
+            the wavelength range, the number of data points and the range
+            of integration times
+
+A file is read again only if its size or modification time has changed,
+so refreshing the catalogue of the whole archive is quick. Batch jobs, gap
+reports and plots can then plan their work from the catalogue.
+
+Example:
+
+    catalogue=LyrCatalogue('lyr-catalogue.sqlite')
+    catalogue.refresh(os.path.join('D:\\\\','KHO','saasdata','data25','Green'),'green')
+    for first, last, path in catalogue.files('green', dt.date(2025,1,1), dt.date(2025,2,1)):
+        ...
+
+"""
+
+import datetime as dt
+import glob
+import os
+import sqlite3
+
+import numpy as np
+
+from lyr_io import read_lyr_headers, scan_times
+
+# The file names of each instrument
+LYR_PATTERNS={
+    'green': '??????G2.lyr',
+    'white': 's??????2.lyr',
+    'silver': 's??????2.lyr',
+}
+
+_SCHEMA='''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    instrument TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    first_time TEXT,
+    last_time TEXT,
+    nscans INTEGER NOT NULL,
+    invalid INTEGER NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_by_instrument ON files (instrument, first_time);
+CREATE TABLE IF NOT EXISTS setups (
+    path TEXT NOT NULL,
+    setup INTEGER NOT NULL,
+    nscans INTEGER NOT NULL,
+    first_time TEXT,
+    last_time TEXT,
+    startwave REAL,
+    stopwave REAL,
+    num_data_points INTEGER NOT NULL,
+    min_integration REAL,
+    max_integration REAL,
+    PRIMARY KEY (path, setup)
+);
+'''
+
+
+def _dbtime(mytime):
+    if mytime is None:
+        return None
+    if isinstance(mytime, np.datetime64):
+        mytime=mytime.astype(dt.datetime)
+    if isinstance(mytime, dt.datetime):
+        return mytime.strftime('%Y-%m-%d %H:%M:%S')
+    return mytime.strftime('%Y-%m-%d 00:00:00')
+
+
+def _fromdb(mytime):
+    if mytime is None:
+        return None
+    return dt.datetime.strptime(mytime,'%Y-%m-%d %H:%M:%S')
+
+
+def _float(value):
+    """
+    A float for the database, None for NaN (a field the instrument does not have)
+    """
+    value=float(value)
+    return None if np.isnan(value) else value
+
+
+def summarise(headers):
+    """
+    Returns the file summary (first_time, last_time, nscans, invalid) and a
+    list of the setup summaries (setup, nscans, first_time, last_time,
+    startwave, stopwave, num_data_points, min_integration, max_integration)
+    of the scan headers of one file. Scans with an invalid time are counted
+    but do not affect the time ranges.
+    """
+    times=scan_times(headers)
+    valid=~np.isnat(times)
+
+    def timerange(mytimes):
+        if len(mytimes)==0:
+            return None, None
+        return _dbtime(mytimes.min()), _dbtime(mytimes.max())
+
+    filesummary=(*timerange(times[valid]), len(headers), int(np.count_nonzero(~valid)))
+
+    setupsummaries=[]
+    for setup in np.unique(headers['setup']):
+        insetup=headers['setup']==setup
+        h=headers[insetup]
+        setupsummaries.append((int(setup), len(h), *timerange(times[insetup & valid]),
+                               _float(np.min(h['startwave'])), _float(np.max(h['stopwave'])),
+                               int(np.max(h['num_data_points'])),
+                               _float(np.min(h['integration'])), _float(np.max(h['integration']))))
+    return filesummary, setupsummaries
+
+
+class LyrCatalogue:
+    """
+    SQLite catalogue of the .lyr-files of the spectrometers
+    """
+
+    def __init__(self, dbfile):
+        self.db=sqlite3.connect(dbfile)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    #-------------------------------------------------------------
+    # Updating the catalogue
+
+    def add_files(self, files, instrument):
+        """
+        Catalogue the given files of an instrument ('green', 'white' or
+        'silver'). Only new and changed files are read. Returns the number
+        of files that were read.
+        """
+        nread=0
+        for filename in files:
+            filename=os.path.normpath(filename)
+            info=os.stat(filename)
+            row=self.db.execute('SELECT size, mtime_ns, instrument FROM files WHERE path=?',
+                                (filename,)).fetchone()
+            if row is not None and row==(info.st_size, info.st_mtime_ns, instrument):
+                continue
+
+            try:
+                headers=read_lyr_headers(filename, instrument)
+                filesummary, setupsummaries=summarise(headers)
+                error=None
+            except (EOFError, ValueError) as e:
+                filesummary, setupsummaries=(None, None, 0, 0), []
+                error=str(e)
+                print(f'   -- {filename}: {error}')
+
+            with self.db:
+                self.db.execute('DELETE FROM setups WHERE path=?', (filename,))
+                self.db.execute('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?)',
+                                (filename, instrument, info.st_size, info.st_mtime_ns,
+                                 *filesummary, error))
+                self.db.executemany('INSERT INTO setups VALUES (?,?,?,?,?,?,?,?,?,?)',
+                                    [(filename, *summary) for summary in setupsummaries])
+            nread+=1
+        return nread
+
+    def refresh(self, sourcepath, instrument, pattern=None):
+        """
+        Bring the catalogue up to date with the files of an instrument in
+        sourcepath (matching pattern, by default from LYR_PATTERNS). Files
+        that have disappeared from sourcepath are removed. Returns the
+        number of files that were read.
+        """
+        if pattern is None:
+            pattern=LYR_PATTERNS[instrument]
+        sourcepath=os.path.normpath(sourcepath)
+        files=set(os.path.normpath(name) for name in glob.glob(os.path.join(sourcepath,pattern)))
+
+        nread=self.add_files(sorted(files), instrument)
+
+        known=self.db.execute('SELECT path FROM files WHERE instrument=?', (instrument,)).fetchall()
+        with self.db:
+            for (path,) in known:
+                if os.path.dirname(path)==sourcepath and path not in files:
+                    self.db.execute('DELETE FROM files WHERE path=?', (path,))
+                    self.db.execute('DELETE FROM setups WHERE path=?', (path,))
+        return nread
+
+    #-------------------------------------------------------------
+    # Queries
+
+    def files(self, instrument, start=None, end=None):
+        """
+        Returns a list of (first_time, last_time, path) of the readable files
+        of an instrument sorted by time, optionally limited to the files with
+        scans between start and end (datetimes or dates)
+        """
+        query='SELECT first_time, last_time, path FROM files WHERE instrument=? AND first_time IS NOT NULL'
+        params=[instrument]
+        if start is not None:
+            query+=' AND last_time>=?'
+            params.append(_dbtime(start))
+        if end is not None:
+            query+=' AND first_time<?'
+            params.append(_dbtime(end))
+        query+=' ORDER BY first_time, path'
+        return [(_fromdb(first), _fromdb(last), path)
+                for first, last, path in self.db.execute(query, params)]
+
+    def days(self, instrument):
+        """
+        Returns a sorted list of the days (dates) with data from an instrument,
+        assuming that each file holds one day as the keograms do
+        """
+        rows=self.db.execute('SELECT DISTINCT substr(first_time,1,10) FROM files '
+                             'WHERE instrument=? AND first_time IS NOT NULL ORDER BY 1', (instrument,))
+        return [dt.date.fromisoformat(day) for (day,) in rows]
+
+    def setups(self, path):
+        """
+        Returns the setups of one file as a list of dictionaries with the
+        columns of the setups table
+        """
+        cursor=self.db.execute('SELECT * FROM setups WHERE path=? ORDER BY setup',
+                               (os.path.normpath(path),))
+        names=[column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def errors(self, instrument):
+        """
+        Returns a list of (path, error) of the files that could not be read
+        """
+        return self.db.execute('SELECT path, error FROM files WHERE instrument=? AND error IS NOT NULL '
+                               'ORDER BY path', (instrument,)).fetchall()
+
+    def gaps(self, instrument, mingap=dt.timedelta(hours=1), start=None, end=None):
+        """
+        Returns a list of (gapstart, gapend) of the gaps of at least mingap
+        between the time ranges of the files of an instrument
+        """
+        gaps=[]
+        covered=None
+        for first, last, path in self.files(instrument, start, end):
+            if covered is not None and first-covered>=mingap:
+                gaps.append((covered, first))
+            covered=last if covered is None else max(covered, last)
+        return gaps
+
+
+#======================================================================
+
+if __name__ == "__main__":
+
+    dbfile=os.path.join('D:\\','KHO','saasdata','lyr-catalogue.sqlite')
+    seasons=['data23','data24','data25','data26']
+    instruments={'green': 'Green', 'white': 'White', 'silver': 'Silver'}
+
+    with LyrCatalogue(dbfile) as catalogue:
+        for season in seasons:
+            for instrument, directory in instruments.items():
+                sourcepath=os.path.join('D:\\','KHO','saasdata',season,directory)
+                nread=catalogue.refresh(sourcepath, instrument)
+                print(f'{sourcepath}: {nread} new or changed files')
+
+        for instrument in instruments:
+            print(f'{instrument}: {len(catalogue.days(instrument))} days, '
+                  f'{len(catalogue.errors(instrument))} unreadable files')
+            for gapstart, gapend in catalogue.gaps(instrument, dt.timedelta(days=1)):
+                print(f'   gap {gapstart} - {gapend}')
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Emission line intensities from the spectrometer scans
+
+The scans (as returned by read_lyr or read_lyr_cached) are integrated over
+wavelength windows, for example around the 557.7 nm and 630.0 nm lines.
+The wavelength of each data point is computed from startwave, stopwave and
+num_data_points of its own scan, so scans with different settings can be
+mixed. The sums over the windows are taken from the cumulative sums of
+the spectra, which gives all scans of a setup in one go.
+
+The result is a NumPy structured array with one record per scan: the time,
+setup, integration time and the integrated counts of each window (NaN if
+the window is outside the wavelength range of the scan). The arrays of
+several days can simply be concatenated, and save_series appends them to
+an .npy-file for a whole season:
+
+    headers, spectra=read_lyr_cached(filename,'green',cachedir)
+    series=line_intensities(headers, spectra, EMISSION_LINES)
+    save_series('green-lines.npy', series)
+
+"""
+
+import os
+import glob
+
+import numpy as np
+
+from lyr_io import read_lyr_cached, scan_times
+
+# The default wavelength windows (nm) of the auroral emission lines
+EMISSION_LINES={
+    'I4278': (427.0, 428.6),
+    'I5577': (557.0, 558.4),
+    'I6300': (629.3, 630.7),
+}
+
+
+def series_dtype(windows):
+    """
+    The record of one scan in the time series for the given windows
+    """
+    return np.dtype([('time','datetime64[s]'), ('setup',np.int8), ('integration',np.float32)]
+                    +[(name,np.float32) for name in windows])
+
+
+def window_bins(headers, low, high):
+    """
+    The first and last data point (inclusive) of each scan inside the
+    wavelength window low...high (nm). The wavelengths of the data points
+    are spaced evenly from startwave to stopwave (Ångström). Returns the
+    two index arrays and a boolean array which is False for the scans that
+    do not have any data points inside the window.
+    """
+    npoints=headers['num_data_points'].astype(np.int64)
+    startwave=headers['startwave']/10
+    step=(headers['stopwave']/10-startwave)/np.maximum(npoints-1,1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        first=np.ceil((low-startwave)/step-1e-9)
+        last=np.floor((high-startwave)/step+1e-9)
+    first=np.maximum(np.nan_to_num(first, nan=0), 0)
+    last=np.minimum(np.nan_to_num(last, nan=-1), npoints-1)
+    inside=(first<=last) & (step>0)
+    return first.astype(np.int64), last.astype(np.int64), inside
+
+
+def line_intensities(headers, spectra, windows=EMISSION_LINES):
+    """
+    Integrated counts of each scan over the wavelength windows, a dictionary
+    of name: (low, high) in nm. The headers and spectra are as returned by
+    read_lyr. Returns a structured array (see series_dtype) with one record
+    per scan in the order of the file.
+    """
+    series=np.zeros(len(headers), dtype=series_dtype(windows))
+    series['time']=scan_times(headers)
+    series['setup']=headers['setup']
+    series['integration']=headers['integration']
+
+    for setup, data in spectra.items():
+        insetup=np.flatnonzero(headers['setup']==setup)
+        if len(insetup)==0:
+            continue
+        setupheaders=headers[insetup]
+
+        # Cumulative sums with a leading zero, so that the sum of the data
+        # points first...last is cumulative[last+1]-cumulative[first]
+        cumulative=np.zeros((data.shape[0], data.shape[1]+1))
+        np.cumsum(data, axis=1, out=cumulative[:,1:])
+        rows=setupheaders['row']
+
+        for name, (low, high) in windows.items():
+            first, last, inside=window_bins(setupheaders, low, high)
+            last=np.maximum(last, first-1)
+            values=cumulative[rows,last+1]-cumulative[rows,first]
+            series[name][insetup]=np.where(inside, values, np.nan)
+
+    return series
+
+
+def file_intensities(filename, instrument, windows=EMISSION_LINES, cachedir=None):
+    """
+    The line intensities of all scans of a .lyr-file
+    """
+    headers, spectra=read_lyr_cached(filename, instrument, cachedir)
+    return line_intensities(headers, spectra, windows)
+
+
+def save_series(filename, series):
+    """
+    Append a time series to an .npy-file (or create it). Records with the
+    same time and setup as existing ones replace them, so a day can be
+    processed again. The file is kept sorted by time.
+    """
+    if os.path.isfile(filename):
+        old=np.load(filename)
+        if old.dtype!=series.dtype:
+            raise ValueError(f'The windows in {filename} differ from the new time series')
+        series=np.concatenate([old, series])
+
+    # Sort by time and setup, and keep the last record of each
+    order=np.lexsort((np.arange(len(series)), series['setup'], series['time']))
+    series=series[order]
+    last=np.ones(len(series), dtype=bool)
+    last[:-1]=(series['time'][1:]!=series['time'][:-1]) | (series['setup'][1:]!=series['setup'][:-1])
+    series=series[last]
+
+    tmpfile=f'{filename}.{os.getpid()}.tmp'
+    with open(tmpfile,'wb') as f:
+        np.save(f, series)
+    os.replace(tmpfile, filename)
+    return series
+
+
+def load_series(filename, start=None, end=None):
+    """
+    Read a time series stored by save_series, optionally limited to
+    start <= time < end (datetimes or numpy datetime64)
+    """
+    series=np.load(filename, mmap_mode='r')
+    first=0 if start is None else np.searchsorted(series['time'], np.datetime64(start,'s'))
+    last=len(series) if end is None else np.searchsorted(series['time'], np.datetime64(end,'s'))
+    return np.array(series[first:last])
+
+
+#======================================================================
+
+if __name__ == "__main__":
+
+    sourcepath=os.path.join('D:\\','KHO','saasdata','data25','Green')
+    cachedir=os.path.join('D:\\','KHO','saasdata','Cache','Green')
+    seriesfile=os.path.join('D:\\','KHO','saasdata','Lines','green-lines.npy')
+
+    os.makedirs(os.path.dirname(seriesfile), exist_ok=True)
+    for filename in sorted(glob.glob(os.path.join(sourcepath,'??????G2.lyr'))):
+        print(f'Processing {filename}')
+        save_series(seriesfile, file_intensities(filename,'green',cachedir=cachedir))
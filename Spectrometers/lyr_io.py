@@ -0,0 +1,674 @@
+# -*- coding: utf-8 -*-
+"""
+Fast reader for the .lyr-files of the Ebert-Fastie spectrometers at KHO
+
+A .lyr-file starts with a fixed number of description lines followed by
+the scans. Each scan is a header line (and, for the Green spectrometer, a
+"Setup # N" line before it) followed by the data points, several per line.
+
+Reading the files one line at a time and converting every number with
+map(int, ...) creates hundreds of thousands of Python objects for a day
+of data. Instead, the whole file is read at once and the number of tokens
+on each line is counted with NumPy. The data block of each scan is then
+located with a single search over the cumulative token counts and parsed
+in one go into a NumPy array.
+
+The scan headers are returned as a NumPy structured array (one record per
+scan in the order of the file) and the data points as one int32 array
+(scans, data points) for each setup. All instruments use the same header
+fields, and the fields that an instrument does not have are NaN. The
+date checks and keogram columns are then computed for all scans at once.
+
+Alternatively, iter_lyr reads the file in chunks and yields one scan at
+a time, and KeogramBuilder fills the keograms from those scans as they
+come. The memory use is then independent of the size of the file.
+
+For a file that is still being written, tail_lyr reads only the scans that
+have been appended since the previous call, and the keograms of
+KeogramBuilder can be saved and continued later. This is used for the
+realtime keograms.
+
+For batch runs, peek_header reads only the first scan header, which is
+enough to find the date of the file and the name of its keogram. The
+files with an existing keogram are then skipped without parsing them.
+
+"""
+
+import os
+import re
+
+import numpy as np
+
+#=================================================================
+# The file formats: the number of description lines to skip, whether each
+# scan has a "Setup # N" line and the header columns with their types.
+
+GREEN_HEADER=(('year',int), ('month',int), ('day',int), ('hour',int), ('minute',int), ('second',int),
+              ('startangle',float), ('stopangle',float), ('order',float), ('slits',float),
+              ('startwave',float), ('stopwave',float), ('calFac',float), ('integration',float),
+              ('num_data_points',int))
+
+WHITE_HEADER=(('year',int), ('month',int), ('day',int), ('hour',int), ('minute',int), ('second',int),
+              ('order',int), ('startwave',float), ('stopwave',float), ('integration',float),
+              ('elevation',float), ('slits',int), ('num_data_points',int))
+
+LYR_FORMATS={
+    'green': (25, True, GREEN_HEADER),
+    'white': (6, False, WHITE_HEADER),
+    'silver': (6, False, WHITE_HEADER),
+}
+
+# The header record of a scan for all instruments. The setup is the number
+# from the "Setup # N" line (0 if there is none, -1 if it is not understood)
+# and row is the index of the scan in the data array of its setup.
+
+HEADER_DTYPE=np.dtype([('year',np.int16), ('month',np.int16), ('day',np.int16),
+                       ('hour',np.int16), ('minute',np.int16), ('second',np.int16),
+                       ('startangle',np.float64), ('stopangle',np.float64),
+                       ('order',np.float64), ('slits',np.float64),
+                       ('startwave',np.float64), ('stopwave',np.float64),
+                       ('calFac',np.float64), ('integration',np.float64),
+                       ('elevation',np.float64), ('num_data_points',np.int32),
+                       ('setup',np.int8), ('row',np.int32)])
+
+_SETUP=re.compile(r'Setup\s*#\s*(\d+)$')
+
+# Lookup table of the whitespace characters that separate the tokens (as
+# in bytes.split)
+_ISSPACE=np.zeros(256, dtype=bool)
+_ISSPACE[[ord(c) for c in ' \t\n\r\x0b\x0c']]=True
+
+
+def _tokens_per_line(data, final=True):
+    """
+    Returns the start and end offsets of each complete line and the
+    cumulative number of whitespace separated tokens before each line (one
+    extra element at the end for the total). Unless final is True, a last
+    line without a newline is incomplete and left out.
+    """
+    buffer=np.frombuffer(data, dtype=np.uint8)
+    lineends=np.flatnonzero(buffer==ord('\n'))+1
+    linestarts=np.concatenate(([0], lineends[:-1]))
+
+    # Like iterating over a file, the last line does not need a newline
+    if final and len(data)>0 and not data.endswith(b'\n'):
+        linestarts=np.append(linestarts, lineends[-1] if len(lineends)>0 else 0)
+        lineends=np.append(lineends, len(data))
+    linestarts=linestarts[:len(lineends)]
+
+    # A token starts with a non-whitespace character after whitespace
+    isspace=_ISSPACE[buffer]
+    tokenstart=~isspace
+    tokenstart[1:]&=isspace[:-1]
+    tokenstarts=np.flatnonzero(tokenstart)
+
+    # The tokens before each line start and the total
+    end=lineends[-1] if len(lineends)>0 else 0
+    cumtokens=np.searchsorted(tokenstarts, np.append(linestarts, end))
+    return linestarts, lineends, cumtokens
+
+
+def _parse_header(header_line, columns):
+    """
+    Convert the header line into a tuple of values of the given columns
+    """
+    header_parts=header_line.split()
+    if len(header_parts)!=len(columns):
+        raise ValueError(f"Header line has {len(header_parts)} columns, expected {len(columns)} "
+                         f"columns: {header_line.strip()}")
+    try:
+        return tuple(valuetype(value) for (name, valuetype), value in zip(columns, header_parts))
+    except ValueError as e:
+        raise ValueError(f"Error parsing header values: {header_line.strip()}") from e
+
+
+def _skip_lines(data, skiplines, final=True):
+    """
+    Returns the offset after the description lines, or None if data does
+    not have all of them yet
+    """
+    offset=0
+    for i in range(skiplines):
+        newline=data.find(b'\n', offset)
+        if newline<0:
+            if final:
+                raise EOFError("Reached end of file before the first scan.")
+            return None
+        offset=newline+1
+    return offset
+
+
+def _parse_scans(data, columns, hassetup, final=True, parsedata=True):
+    """
+    Parse the scans in data, which starts at the beginning of a scan. Yields
+    (values, setup, spectrum, end) for each scan, where values are the
+    header values of the columns and end is the offset after the scan.
+    Unless final is True, the parsing stops quietly at a scan that is not
+    complete yet. With parsedata=False the data points are only counted and
+    spectrum is None.
+    """
+    linestarts, lineends, cumtokens=_tokens_per_line(data, final)
+    nlines=len(linestarts)
+
+    def getline(i):
+        return data[linestarts[i]:lineends[i]].decode('ascii', errors='replace')
+
+    line=0
+    while line<nlines:
+        setup=0
+        if hassetup:
+            # Expect to get either "Setup # 1" or "Setup # 2"
+            setupmatch=_SETUP.match(getline(line).strip())
+            setup=int(setupmatch.group(1)) if setupmatch else -1
+            line+=1
+            if line>=nlines:
+                break # End of file reached
+
+        header_line=getline(line)
+        line+=1
+        if not header_line.split(): # Skip empty lines
+            continue
+
+        values=_parse_header(header_line, columns)
+        num_data_points=values[-1]
+
+        # The data continues until the lines contain the expected number
+        # of data points
+        end=np.searchsorted(cumtokens, cumtokens[line]+num_data_points, side='left')
+        if end>nlines:
+            if not final:
+                return # Wait for the rest of the scan
+            raise EOFError(f"Reached end of file before reading the expected {num_data_points} data points.")
+        if cumtokens[end]-cumtokens[line]!=num_data_points:
+            raise ValueError(f"Expected {num_data_points} data points, but read {cumtokens[end]-cumtokens[line]}.")
+
+        if not parsedata:
+            line=end
+            yield values, setup, None, int(lineends[end-1]) if end>0 else 0
+            continue
+
+        block=data[linestarts[line]:lineends[end-1]] if end>line else b''
+        try:
+            spectrum=np.fromstring(block, dtype=np.int32, sep=' ')
+        except ValueError:
+            spectrum=None
+        if spectrum is None or spectrum.size!=num_data_points:
+            # Find the offending line for the error message
+            for i in range(line, end):
+                try:
+                    list(map(int, getline(i).split()))
+                except ValueError:
+                    raise ValueError(f"Error parsing data line: {getline(i).strip()}")
+            raise ValueError(f"Error parsing data lines after: {header_line.strip()}")
+
+        line=end
+        yield values, setup, spectrum, int(lineends[end-1]) if end>0 else 0
+
+
+def _header_table(records, setups, columns):
+    """
+    Collect the header values of the given columns into the common record
+    format. The row of each scan in its setup is counted from zero.
+    """
+    headers=np.zeros(len(records), dtype=HEADER_DTYPE)
+    for name in HEADER_DTYPE.names:
+        if HEADER_DTYPE[name].kind=='f':
+            headers[name]=np.nan
+    if len(records)>0:
+        values=np.array(records, dtype=[(name, HEADER_DTYPE[name]) for name, valuetype in columns])
+        for name, valuetype in columns:
+            headers[name]=values[name]
+
+    setups=np.array(setups, dtype=np.int8)
+    headers['setup']=setups
+    for setup in np.unique(setups):
+        insetup=setups==setup
+        headers['row'][insetup]=np.arange(np.count_nonzero(insetup))
+    return headers
+
+
+def read_lyr(filename, instrument):
+    """
+    Read all scans of a .lyr-file of the given instrument ('green', 'white'
+    or 'silver'). Returns the headers (a structured array with HEADER_DTYPE)
+    and a dictionary with an int32 array of the data points (one scan per
+    row) for each setup. Files without setup lines have only setup 0.
+
+    Raises EOFError if the file ends in the middle of a scan, and
+    ValueError if a header has a wrong number of columns, a value cannot
+    be parsed, the number of data points does not match the header or the
+    scans of one setup have different numbers of data points.
+    """
+    skiplines, hassetup, columns=LYR_FORMATS[instrument]
+
+    with open(filename,'rb') as f:
+        data=f.read()
+
+    start=_skip_lines(data, skiplines)
+    headers, spectra, end=_collect_scans(_parse_scans(data[start:], columns, hassetup), columns, filename)
+    return headers, spectra
+
+
+def _collect_scans(scans, columns, filename):
+    """
+    Collect the scans from _parse_scans into the headers and the data arrays
+    of each setup. Returns also the offset after the last scan.
+    """
+    records=[]
+    setups=[]
+    spectra={}
+    lastend=0
+    for values, setup, spectrum, end in scans:
+        records.append(values)
+        setups.append(setup)
+        spectra.setdefault(setup, []).append(spectrum)
+        lastend=end
+
+    for setup, setupspectra in spectra.items():
+        if len(set(len(spectrum) for spectrum in setupspectra))>1:
+            raise ValueError(f"Varying number of data points in setup {setup} of {filename}")
+        spectra[setup]=np.array(setupspectra, dtype=np.int32)
+
+    return _header_table(records, setups, columns), spectra, lastend
+
+
+def tail_lyr(filename, instrument, offset=0):
+    """
+    Read the complete scans appended to a .lyr-file that is still being
+    written. The offset is the byte offset after the last complete scan,
+    as returned by the previous call (0 to start from the beginning). A
+    scan that is not completely written yet is left for the next call.
+
+    Returns (headers, spectra, offset) where the headers and spectra of the
+    new scans are as in read_lyr (the rows counted from the first new scan)
+    and offset is the one for the next call.
+    """
+    skiplines, hassetup, columns=LYR_FORMATS[instrument]
+
+    with open(filename,'rb') as f:
+        f.seek(offset)
+        data=f.read()
+
+    start=0
+    if offset==0:
+        start=_skip_lines(data, skiplines, final=False)
+        if start is None:
+            return _header_table([], [], columns), {}, 0 # Not even the description yet
+
+    headers, spectra, end=_collect_scans(_parse_scans(data[start:], columns, hassetup, final=False),
+                                         columns, filename)
+    return headers, spectra, offset+start+end
+
+
+def read_lyr_headers(filename, instrument):
+    """
+    Read only the scan headers of a .lyr-file, see read_lyr. The data
+    points are counted but not converted, which takes about half the time
+    of reading the whole file.
+    """
+    skiplines, hassetup, columns=LYR_FORMATS[instrument]
+
+    with open(filename,'rb') as f:
+        data=f.read()
+
+    records=[]
+    setups=[]
+    start=_skip_lines(data, skiplines)
+    for values, setup, spectrum, end in _parse_scans(data[start:], columns, hassetup, parsedata=False):
+        records.append(values)
+        setups.append(setup)
+
+    return _header_table(records, setups, columns)
+
+
+def iter_lyr(filename, instrument, chunksize=2**20):
+    """
+    Yield the scans of a .lyr-file one at a time as (header, spectrum), where
+    header is a record with HEADER_DTYPE and spectrum an int32 array. The
+    file is read in chunks of chunksize bytes, so the memory use does not
+    depend on the size of the file. The checks are the same as in read_lyr.
+    """
+    skiplines, hassetup, columns=LYR_FORMATS[instrument]
+    rows={}
+
+    with open(filename,'rb') as f:
+        data=b''
+        start=None
+        final=False
+        while not final:
+            chunk=f.read(chunksize)
+            final=len(chunk)==0
+            data+=chunk
+
+            if start is None:
+                start=_skip_lines(data, skiplines, final)
+                if start is None:
+                    continue
+
+            consumed=start
+            for values, setup, spectrum, end in _parse_scans(data[start:], columns, hassetup, final):
+                header=_header_table([values], [setup], columns)[0]
+                header['row']=rows.get(setup,0)
+                rows[setup]=header['row']+1
+                consumed=start+end
+                yield header, spectrum
+
+            # Keep the incomplete scan for the next chunk
+            data=data[consumed:]
+            start=0
+
+
+def peek_header(filename, instrument):
+    """
+    Read only the header of the first scan of a .lyr-file. Returns a record
+    with HEADER_DTYPE, or None if the file has no scans. The reading stops
+    at the header, so this is cheap however large the file is.
+    """
+    skiplines, hassetup, columns=LYR_FORMATS[instrument]
+
+    with open(filename,'rb') as f:
+        for i in range(skiplines):
+            if not f.readline().endswith(b'\n'):
+                raise EOFError("Reached end of file before the first scan.")
+
+        while True:
+            setup=0
+            if hassetup:
+                line=f.readline()
+                if not line:
+                    return None
+                setupmatch=_SETUP.match(line.decode('ascii', errors='replace').strip())
+                setup=int(setupmatch.group(1)) if setupmatch else -1
+
+            line=f.readline()
+            if not line:
+                return None
+            header_line=line.decode('ascii', errors='replace')
+            if header_line.split(): # Skip empty lines
+                return _header_table([_parse_header(header_line, columns)], [setup], columns)[0]
+
+
+def keogram_filename(destination, prefix, header):
+    """
+    Name of the daily keogram png-file for the date of a scan header, for
+    example Green_20250127.png
+    """
+    year, month, day=int(header['year']), int(header['month']), int(header['day'])
+    return os.path.join(destination, f'{prefix}_{year}{month:02}{day:02}.png')
+
+
+def missing_keograms(files, instrument, destination, prefix):
+    """
+    Returns the files whose keogram (see keogram_filename) does not exist in
+    destination. Only the first scan header of each file is read. Files
+    that cannot be peeked at are kept, so that the error is reported when
+    they are processed.
+    """
+    missing=[]
+    for filename in files:
+        try:
+            header=peek_header(filename, instrument)
+        except (EOFError, ValueError):
+            header=None
+        if header is None or not os.path.isfile(keogram_filename(destination, prefix, header)):
+            missing.append(filename)
+    return missing
+
+
+def iter_scans(headers, spectra):
+    """
+    Yield the scans returned by read_lyr (or read_lyr_cached) one at a time
+    as (header, spectrum), like iter_lyr
+    """
+    for header in headers:
+        yield header, spectra[header['setup']][header['row']]
+
+
+#=================================================================
+# Cache of the parsed files
+
+# Increase this if the contents of the cache files change
+_CACHE_VERSION=1
+
+
+def cache_filename(filename, cachedir=None):
+    """
+    Name of the cache file of a .lyr-file, next to the file itself unless
+    a cache directory is given
+    """
+    if cachedir is None:
+        return filename+'.npz'
+    return os.path.join(cachedir, os.path.basename(filename)+'.npz')
+
+
+def read_lyr_cached(filename, instrument, cachedir=None):
+    """
+    Like read_lyr, but the parsed scans are stored in a compressed .npz-file
+    (see cache_filename) and read from there as long as the size and the
+    modification time of the .lyr-file are the same as when it was parsed.
+    """
+    info=os.stat(filename)
+    source=np.array([_CACHE_VERSION, info.st_size, info.st_mtime_ns], dtype=np.int64)
+    cachefile=cache_filename(filename, cachedir)
+
+    try:
+        with np.load(cachefile) as cached:
+            if np.array_equal(cached['source'], source):
+                headers=cached['headers']
+                spectra={int(name[8:]): cached[name] for name in cached.files
+                         if name.startswith('spectra_')}
+                return headers, spectra
+    except (OSError, ValueError, KeyError):
+        pass # Missing or broken cache file, parse again
+
+    headers, spectra=read_lyr(filename, instrument)
+
+    # Write the cache under a temporary name first, so that a partial file
+    # is never used
+    if cachedir is not None:
+        os.makedirs(cachedir, exist_ok=True)
+    tmpfile=f'{cachefile}.{os.getpid()}.tmp'
+    with open(tmpfile,'wb') as f:
+        np.savez_compressed(f, source=source, headers=headers,
+                            **{f'spectra_{setup}': data for setup, data in spectra.items()})
+    os.replace(tmpfile, cachefile)
+    return headers, spectra
+
+
+#=================================================================
+# Operations on all scans at once
+
+def valid_times(headers):
+    """
+    Returns a boolean array that is True for the scans with a valid date and
+    time (as accepted by strptime with '%Y-%m-%d %H:%M:%S')
+    """
+    year=headers['year'].astype(np.int64)
+    month=headers['month'].astype(np.int64)
+    day=headers['day'].astype(np.int64)
+
+    valid=(year>=1000) & (year<=9999) & (month>=1) & (month<=12) & (day>=1)
+    valid&=(headers['hour']>=0) & (headers['hour']<=23)
+    valid&=(headers['minute']>=0) & (headers['minute']<=59)
+    valid&=(headers['second']>=0) & (headers['second']<=59)
+
+    # The day must exist in the month
+    firstday=((np.where(valid, year, 1970)-1970)*12+np.where(valid, month, 1)-1).astype('datetime64[M]')
+    monthlength=((firstday+1).astype('datetime64[D]')-firstday.astype('datetime64[D]')).astype(np.int64)
+    return valid & (day<=monthlength)
+
+
+def scan_times(headers):
+    """
+    The time of each scan as datetime64[s], NaT for the invalid times
+    """
+    valid=valid_times(headers)
+    times=np.full(len(headers), np.datetime64('NaT'), dtype='datetime64[s]')
+    if np.any(valid):
+        h=headers[valid]
+        days=((h['year'].astype(np.int64)-1970)*12+h['month']-1).astype('datetime64[M]').astype('datetime64[D]')
+        days+=(h['day']-1).astype('timedelta64[D]')
+        times[valid]=days+(3600*h['hour'].astype(np.int64)+60*h['minute']+h['second']).astype('timedelta64[s]')
+    return times
+
+
+def minute_index(headers):
+    """
+    The keogram column of each scan: the minute of the day rounded to the
+    nearest full minute, but limited to the current day
+    """
+    minutes=60*headers['hour'].astype(np.int64)+headers['minute']+np.round(headers['second']/60).astype(np.int64)
+    return np.minimum(minutes, 24*60-1)
+
+
+def last_per_column(columns):
+    """
+    Returns the unique columns and, for each, the position of the last entry
+    for it. Filling the columns of a keogram in the order of the entries
+    leaves exactly these values.
+    """
+    reverse=columns[::-1]
+    unique, first=np.unique(reverse, return_index=True)
+    return unique, len(columns)-1-first
+
+
+def fill_keogram(keogram, headers, spectra, extend=False):
+    """
+    Copy the scans of one setup into the keogram columns given by
+    minute_index. The headers are those of the setup (in the order of the
+    file) and spectra the data array of the setup. A later scan replaces an
+    earlier one in the same column, exactly as when copying one scan at a
+    time. With extend=True each scan also fills the next column to cover
+    missing data in the keogram.
+    """
+    columns=minute_index(headers)
+    order=np.arange(len(headers))
+    if extend:
+        columns=np.stack([columns, columns+1], axis=1).ravel()
+        order=np.repeat(order, 2)
+        inside=columns<keogram.shape[1]
+        columns, order=columns[inside], order[inside]
+
+    columns, last=last_per_column(columns)
+    keogram[:,columns]=spectra[headers['row'][order[last]]].T
+
+
+def print_header(header, number):
+    """
+    Print the fields of one header record (for error messages)
+    """
+    print(f"\nHeader {number}:")
+    for key in header.dtype.names:
+        print(f"{key}: {header[key]}")
+
+
+class KeogramBuilder:
+    """
+    Fill the keograms of one day from scans as they are read (see iter_lyr).
+    The scans are collected into small batches that are checked and copied
+    into the keograms at once, so only the keograms and one batch are kept
+    in memory. The results are the same as when copying all scans in the
+    order of the file.
+    """
+
+    def __init__(self, filename, filedate, nrows, extend=False, batchsize=256):
+        """
+        filename  - name of the data file for the error messages
+        filedate  - (year, month, day) that all scans must have
+        nrows     - number of data points (keogram rows) for each setup
+        extend    - also fill the next column with each scan
+        """
+        self.filename=filename
+        self.filedate=filedate
+        self.keograms={setup: np.zeros((rows,24*60)) for setup, rows in nrows.items()}
+        self.extend=extend
+        self.batchsize=batchsize
+        self.first={} # The first and last header of each setup
+        self.last={}
+        self.nscans=0
+
+    def save(self, statefile, offset):
+        """
+        Store the keograms and the first and last headers into statefile
+        (.npz) together with the offset in the data file (see tail_lyr), so
+        that the keograms can be continued in a later run with load
+        """
+        state={'filename': np.array(self.filename), 'filedate': np.array(self.filedate),
+               'extend': np.array(self.extend), 'nscans': np.array(self.nscans),
+               'offset': np.array(offset)}
+        for setup, keogram in self.keograms.items():
+            state[f'keogram_{setup}']=keogram
+            if setup in self.first:
+                state[f'first_{setup}']=np.array(self.first[setup], dtype=HEADER_DTYPE)
+                state[f'last_{setup}']=np.array(self.last[setup], dtype=HEADER_DTYPE)
+
+        # Replace the old state only once the new one is completely written
+        tmpfile=f'{statefile}.{os.getpid()}.tmp'
+        with open(tmpfile,'wb') as f:
+            np.savez(f, **state)
+        os.replace(tmpfile, statefile)
+
+    @classmethod
+    def load(cls, statefile):
+        """
+        Returns the builder and the offset in the data file stored by save
+        """
+        with np.load(statefile) as state:
+            setups=[int(name[8:]) for name in state.files if name.startswith('keogram_')]
+            builder=cls(str(state['filename']), tuple(int(x) for x in state['filedate']),
+                        {setup: state[f'keogram_{setup}'].shape[0] for setup in setups},
+                        extend=bool(state['extend']))
+            for setup in setups:
+                builder.keograms[setup]=state[f'keogram_{setup}']
+                if f'first_{setup}' in state.files:
+                    builder.first[setup]=state[f'first_{setup}'][()]
+                    builder.last[setup]=state[f'last_{setup}'][()]
+            builder.nscans=int(state['nscans'])
+            return builder, int(state['offset'])
+
+    def add_scans(self, scans):
+        """
+        Add the scans from an iterable of (header, spectrum)
+        """
+        batch=[]
+        for scan in scans:
+            batch.append(scan)
+            if len(batch)==self.batchsize:
+                self._add_batch(batch)
+                batch=[]
+        if len(batch)>0:
+            self._add_batch(batch)
+        return self
+
+    def _add_batch(self, batch):
+        headers=np.array([header for header, spectrum in batch], dtype=HEADER_DTYPE)
+
+        # Check that the dates are identical to the file date and valid
+        fileyear, filemonth, fileday=self.filedate
+        samedate=(headers['year']==fileyear) & (headers['month']==filemonth) & (headers['day']==fileday)
+        if not np.all(samedate):
+            raise Exception(f'File date vs. record date mismatch in {self.filename}')
+
+        valid=valid_times(headers)
+        if not np.all(valid):
+            i=np.flatnonzero(~valid)[0]
+            print_header(headers[i], self.nscans+i+1)
+            raise Exception(f'Invalid  date in {self.filename}')
+
+        unknown=~np.isin(headers['setup'], list(self.keograms))
+        if np.any(unknown):
+            raise Exception(f"Unidentified setup {headers['setup'][unknown][0]} in {self.filename}")
+
+        for setup, keogram in self.keograms.items():
+            insetup=np.flatnonzero(headers['setup']==setup)
+            if len(insetup)==0:
+                continue
+            setupheaders=headers[insetup]
+            self.first.setdefault(setup, setupheaders[0])
+            self.last[setup]=setupheaders[-1]
+
+            setupheaders['row']=np.arange(len(insetup))
+            spectra=np.array([batch[i][1] for i in insetup])
+            fill_keogram(keogram, setupheaders, spectra, self.extend)
+
+        self.nscans+=len(batch)
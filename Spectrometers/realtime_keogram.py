@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Realtime keograms of the spectrometers from the file that is being written
+
+The daily keograms skip the files of the last two days, which may still be
+incomplete. Here the latest file is followed instead: each run reads only
+the scans that have been appended since the previous run (see tail_lyr)
+and adds them to the keograms kept in a state file. A scan that is still
+being written is left for the next run. When a new file appears, the
+keograms are started again from the beginning of that file.
+"""
+
+import os
+import glob
+
+import matplotlib
+matplotlib.use('Agg') # No windows, the keograms are only saved
+
+from lyr_io import tail_lyr, iter_scans, KeogramBuilder
+from lyr_catalogue import LYR_PATTERNS
+from green_keogram import plot_green_keogram
+from white_keogram import plot_white_keogram
+from silver_keogram import plot_silver_keogram
+
+# The keogram rows of each setup, whether each scan also fills the next
+# column (see KeogramBuilder) and the plotting function
+REALTIME={
+    'green': ({1:708, 2:814}, True, plot_green_keogram),
+    'white': ({0:756}, False, plot_white_keogram),
+    'silver': ({0:381}, False, plot_silver_keogram),
+}
+
+
+def loadstate(statefile, filename):
+    """
+    Returns (builder, offset) of the file from the state file, or
+    (None, 0) if there is no usable state for that file
+    """
+    if statefile is not None and os.path.isfile(statefile):
+        try:
+            builder, offset=KeogramBuilder.load(statefile)
+            if builder.filename==filename and offset<=os.path.getsize(filename):
+                return builder, offset
+        except Exception as error:
+            print('Could not read', statefile)
+            print(error)
+
+    return None, 0
+
+
+def updatekeogram(sourcepath, instrument, savefilename, statefile):
+    """
+    Add the new scans of the latest file of the instrument in sourcepath to
+    the keograms and plot them into savefilename. Returns the number of new
+    scans.
+    """
+    nrows, extend, plotkeogram=REALTIME[instrument]
+
+    files=glob.glob(os.path.join(sourcepath,LYR_PATTERNS[instrument]))
+    if len(files)==0:
+        print(f'No {instrument} files in {sourcepath}')
+        return 0
+    filename=max(files, key=os.path.getmtime)
+
+    builder, offset=loadstate(statefile, filename)
+    headers, spectra, offset=tail_lyr(filename, instrument, offset)
+    if len(headers)==0:
+        print(f'No new scans in {filename}')
+        return 0
+
+    if builder is None:
+        print(f'Starting the keograms of {filename}')
+        builder=KeogramBuilder(filename, (int(headers['year'][0]),int(headers['month'][0]),int(headers['day'][0])),
+                               nrows, extend=extend)
+    builder.add_scans(iter_scans(headers, spectra))
+    builder.save(statefile, offset)
+    print(f'   -- {len(headers)} new scans, {builder.nscans} in total')
+
+    # Wait until all setups have scans for the wavelength ranges
+    if len(builder.last)<len(nrows):
+        return len(headers)
+
+    last=max((int(header['hour']),int(header['minute'])) for header in builder.last.values())
+    fileyear, filemonth, fileday=builder.filedate
+    title=(f'KHO/UNIS {instrument.capitalize()} Ebert-Fastie spectrometer {fileyear}-{filemonth:02}-{fileday:02} '
+           f'until {last[0]:02}:{last[1]:02} UT')
+    plotkeogram(builder, savefilename, title)
+    print('Stored ' + savefilename)
+    return len(headers)
+
+
+#======================================================================
+
+if __name__ == "__main__":
+
+    sourcepath=os.path.join('E:\\','Incoming','saasdata','data26')
+    webbase=os.path.join('Z:\\','kho','Spectrometers')
+
+    # The keograms are kept between the runs
+    statepath=os.path.join('D:\\','KHO','saasdata','Realtime')
+    os.makedirs(statepath, exist_ok=True)
+
+    for instrument, directory in [('green','Green'), ('white','White'), ('silver','Silver')]:
+        updatekeogram(os.path.join(sourcepath,directory), instrument,
+                      os.path.join(webbase,f'{directory}-realtime.png'),
+                      os.path.join(statepath,f'{directory}-realtime-state.npz'))
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Make the keograms of one spectrometer for all files in a directory
+
+The files are independent jobs that are spread over a pool of processes
+(see backfill.py), so reprocessing whole seasons scales with the
+number of cores. A file that cannot be processed is reported at the end
+instead of stopping the run, and errors in reading or writing the files
+are retried. For example:
+
+    python spectrometer_batch.py green D:\\KHO\\saasdata\\data25\\Green D:\\KHO\\saasdata\\Keograms\\Green results.csv
+
+"""
+
+import os
+import sys
+import glob
+from functools import partial
+
+import matplotlib
+matplotlib.use('Agg') # No windows, the keograms are only saved
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from backfill import run_backfill, write_results
+
+from lyr_io import missing_keograms
+from lyr_catalogue import LYR_PATTERNS
+from green_keogram import make_green_keogram
+from white_keogram import make_white_keogram
+from silver_keogram import make_silver_keogram
+
+# The keogram function and the file name prefix of the keograms
+KEOGRAMS={
+    'green': (make_green_keogram, 'Green'),
+    'white': (make_white_keogram, 'White'),
+    'silver': (make_silver_keogram, 'Silver'),
+}
+
+
+def run_batch(instrument, sourcepath, destination, onlymissing=True, cachedir=None,
+              workers=None, retries=2):
+    """
+    Make the keograms of the instrument ('green', 'white' or 'silver') for
+    the files in sourcepath. With onlymissing=True only the files without a
+    keogram in destination are processed, otherwise all keograms are made
+    again. Returns the results of run_backfill, one (job, status, message,
+    seconds) for each file.
+    """
+    makekeogram, prefix=KEOGRAMS[instrument]
+    files=sorted(glob.glob(os.path.join(sourcepath,LYR_PATTERNS[instrument])))
+    print(f'{len(files)} {instrument} files in {sourcepath}')
+    if onlymissing:
+        files=missing_keograms(files, instrument, destination, prefix)
+        print(f'{len(files)} files without a keogram')
+
+    jobfunc=partial(makekeogram, destination=destination, overwrite=not onlymissing, cachedir=cachedir)
+    return run_backfill(jobfunc, [(filename,) for filename in files], workers, retries)
+
+
+#======================================================================
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4,5) or sys.argv[1] not in KEOGRAMS:
+        sys.exit("spectrometer_batch [green|white|silver] [sourcepath] [destination] [results.csv]")
+
+    instrument, sourcepath, destination=sys.argv[1:4]
+
+    # Set the number of worker processes to match the computer (None uses
+    # all cores, 1 processes the files one at a time)
+    workers=None
+
+    # Only make the missing keograms (set to False to make all again)
+    onlymissing=True
+
+    # The parsed files are cached here (set to None to disable)
+    cachedir=os.path.join('D:\\','KHO','saasdata','Cache',KEOGRAMS[instrument][1])
+
+    results=run_batch(instrument, sourcepath, destination, onlymissing, cachedir, workers)
+
+    if len(sys.argv)==5:
+        write_results(results, sys.argv[4])
+        print('Stored', sys.argv[4])
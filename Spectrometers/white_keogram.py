@@ -10,11 +10,14 @@ import datetime as dt
 import numpy as np
 import matplotlib.pyplot as plt
 import glob
+import itertools
+import sys
 
-# "Flatten" a list, clever function from stackoverflow
-# https://stackoverflow.com/questions/952914/how-do-i-make-a-flat-list-out-of-a-list-of-lists
-def flatten(xss):
-    return [x for xs in xss for x in xs]
+from lyr_io import read_lyr, iter_lyr, read_lyr_cached, iter_scans, print_header, KeogramBuilder
+from lyr_io import peek_header, keogram_filename, missing_keograms
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from figure_template import FigureTemplate
 
 # A helper function for choosing the maximum counts to be plotted
 def next_multiple_of_100(value):
@@ -22,105 +25,99 @@ def next_multiple_of_100(value):
 
 
 def read_spectrogram_data(filename):
-    with open(filename, 'r') as file:
-        # Skip the first 6 rows
-        for _ in range(6):
-            next(file)
-
-        all_data = []  # To store the list of (header, data) pairs
-
-        while True:
-            # Read the first row (header) which should contain 13 elements
-            header_line = next(file, None)
-            if header_line is None:
-                break  # End of file reached
-
-            # Debugging: Print the raw header line
-            #print(f"Header line: {header_line.strip()}")
-
-            # Split the header line into parts
-            header_parts = header_line.strip().split()
-
-            if not header_parts:  # Skip empty lines
-                continue
-            
-            if len(header_parts) != 13:
-                raise ValueError(f"Header line has {len(header_parts)} columns, expected 13 columns: {header_line.strip()}")
-            
-            # Extract header information with appropriate types (int or float)
-            try:
-                year, month, day, hour, minute, second, order = map(int, header_parts[:7])  # These are integers
-                startwave, stopwave, integration, elevation = map(float, header_parts[7:11])  # These are floats
-                slits, num_data_points = map(int, header_parts[11:13])  # These are integers
-            except ValueError as e:
-                raise ValueError(f"Error parsing header values: {header_line.strip()}") from e
-
-            header = {
-                'year': year,
-                'month': month,
-                'day': day,
-                'hour': hour,
-                'minute': minute,
-                'second': second,
-                'order': order,
-                'startwave': startwave,
-                'stopwave': stopwave,
-                'integration': integration,
-                'elevation': elevation,
-                'slits': slits,
-                'num_data_points': num_data_points
-            }
-
-            # Initialize list to store the data points for this header
-            data_points = []
-
-            # Variable to track the total number of data points we have read
-            total_data_points_read = 0
-
-            # Read data until we've accumulated the correct number of data points
-            while total_data_points_read < num_data_points:
-                data_line = next(file, None)
-                if data_line is None:
-                    raise EOFError(f"Reached end of file before reading the expected {num_data_points} data points.")
-
-                try:
-                    data_parts = list(map(int, data_line.strip().split()))
-                except ValueError:
-                    raise ValueError(f"Error parsing data line: {data_line.strip()}")
-                
-                num_data_in_row = len(data_parts)
-                total_data_points_read += num_data_in_row
-
-                # Add this row of data points
-                data_points.append(data_parts)
-
-            # Check if we read the correct number of data points
-            if total_data_points_read != num_data_points:
-                raise ValueError(f"Expected {num_data_points} data points, but read {total_data_points_read}.")
-
-            # Store the header and its corresponding data points
-            all_data.append((header, flatten(data_points)))
-
-        return all_data
-
-def make_white_keogram(filename,destination):
-    all_data = read_spectrogram_data(filename)
-    if len(all_data)<1:
+    """
+    Returns the headers (a structured array) and the spectra (an int32
+    array with one scan per row), see lyr_io.py
+    """
+    headers, spectra=read_lyr(filename,'white')
+    return headers, spectra.get(0, np.zeros((0,0), dtype=np.int32))
+
+def white_figure(keogram, extent, title):
+    """
+    The figure of the keogram
+    """
+    # Create the plot
+    plt.figure(figsize=(12, 5))
+    
+    plt.imshow(keogram, aspect='auto', extent=extent, origin='lower', cmap='viridis')
+    
+    # Set labels for the axes
+    plt.xlabel("Time (hours)")
+    ticks=np.arange(0,25,2)
+    tick_labels=[f"{int(t):02d}" for t in ticks]
+    plt.xticks(ticks,tick_labels)
+    
+    plt.ylabel("Wavelength (nm)")
+    plt.colorbar(label='Counts')
+    
+    plt.title(title)
+    
+    return plt.gcf()
+
+
+# The figure is built once in each process and reused for all keograms
+_template=None
+
+def plot_white_keogram(builder, keofilename, title=None):
+    """
+    Plot the keogram filled by a KeogramBuilder into keofilename. The
+    wavelength range is taken from the first scan.
+    """
+    global _template
+    fileyear, filemonth, fileday=builder.filedate
+    if title is None:
+        title=f'KHO/UNIS 1/2m White Ebert-Fastie spectrometer {fileyear}-{filemonth:02}-{fileday:02}'
+
+    keogram=builder.keograms[0]
+    lambda_min=builder.first[0]['startwave']/10
+    lambda_max=builder.first[0]['stopwave']/10
+        
+    # Limit the intensity range. The limit should probably be something
+    # that is determined by the data rather than this fixed value.
+    clipValue=next_multiple_of_100(np.percentile(keogram,99))
+    #print(f'Clipping at {clipValue}')
+    keogram=np.clip(keogram,0,clipValue) 
+    
+    if _template is None:
+        _template=FigureTemplate(white_figure(np.zeros(keogram.shape), [0, 24, 0, 1], 'TITLE'), 'TITLE',
+                                 dpi=100, bbox_inches='tight')
+
+    # Save the plot as a PNG file for the keogram website
+    _template.render(keogram, keofilename, title, extents=[[0, 24, lambda_min, lambda_max]])
+
+
+def make_white_keogram(filename,destination, overwrite=False, cachedir=None):
+    # Peek at the first scan header for the name of the keogram, and skip
+    # the file before parsing it if the keogram already exists
+    header=peek_header(filename,'white')
+    if header is None:
+        raise Exception(f'No data in {filename}')
+    keofilename=keogram_filename(destination,'White',header)
+    if overwrite==False and os.path.isfile(keofilename)==True:
+        print(f'   -- keogram {keofilename} exists, skipping...')
+        return 'exists'
+
+    # The scans are read one at a time while filling the keogram, or from
+    # the cache of parsed files if a cache directory is given
+    if cachedir is None:
+        scans=iter_lyr(filename,'white')
+    else:
+        scans=iter_scans(*read_lyr_cached(filename,'white',cachedir))
+    firstscan=next(scans, None)
+    if firstscan is None:
         raise Exception(f'No data in {filename}')
     
     keogram=np.zeros((756,24*60)) # One minute resolution
     
     # First read the first head to extract the date for the datafile
-    (header, data_points) = all_data[0]
-    fileyear, filemonth, fileday = header['year'],header['month'],header['day']
+    header = firstscan[0]
+    fileyear, filemonth, fileday = int(header['year']),int(header['month']),int(header['day'])
     
     datefromheader=f'{fileyear}-{filemonth:02}-{fileday:02}'
     try:
         dt.datetime.strptime(datefromheader,'%Y-%m-%d')
     except ValueError:
-        print("\nHeader 1:")
-        for key, value in header.items():
-            print(f"{key}: {value}")
+        print_header(header, 1)
         raise Exception(f'Invalid date in {filename}')
 
     # Skip today's and yesterday's data which may still be incomplete
@@ -130,85 +127,17 @@ def make_white_keogram(filename,destination):
     timedelta=today-filedate
     if timedelta.days<2:
         print("...skipping too recent data")
-        return
+        return 'too recent'
 
-    lambda_min=header['startwave']/10
-    lambda_max=header['stopwave']/10
-    
-    # Go through the data and copy scan data to keogram.
-    # Check that the dates for each scan are identical.
-    # It is possible that some of the other parameters have changed, too,
-    # but this is a summary plot...
-    
-    for i, (header, data_points) in enumerate(all_data):
-        # Check that dates are identical in all headers
-        thisyear=header['year']
-        thismonth=header['month']
-        thisday=header['day']
-    
-        if thisyear != fileyear or thismonth != filemonth or thisday != fileday:
-            raise Exception(f'File date vs. record date mismatch in {filename}')        
-    
-        thishh=header['hour']
-        thismm=header['minute']
-        thisss=header['second']
-    
-        # Check the date is a valid date    
-        datefromheader=f'{thisyear}-{thismonth:02}-{thisday:02} {thishh:02}:{thismm:02}:{thisss:02}'
-        try:
-            dt.datetime.strptime(datefromheader,'%Y-%m-%d %H:%M:%S')
-        except ValueError:
-            print(f"\nHeader {i + 1}:")
-            for key, value in header.items():
-                print(f"{key}: {value}")
-            raise Exception(f'Invalid  date in {filename}')
-  
-        keofilename=os.path.join(destination,f'White_{fileyear}{filemonth:02}{fileday:02}.png')
-        if os.path.isfile(keofilename)==True:
-            print(f'   -- keogram {keofilename} exists, skipping...')
-            return
-
-        #print("\nData Points (first 3 numbers of this block):")
-        #for row in data_points[:3]:
-        #    print(row)
-    
-      
-        spectrum=np.array(data_points)
-        
-        # Calculate the location in the keogram based on the time. Round
-        # to the nearest full minute but limit the index to the current day.
-        # Don't care about overwriting any previous data, this is a summary
-        # plot...
-        
-        index=min(60*thishh+thismm+round(thisss/60),24*60-1)
-        
-        keogram[:,index]=spectrum
-        
-    # Limit the intensity range. The limit should probably be something
-    # that is determined by the data rather than this fixed value.
-    clipValue=next_multiple_of_100(np.percentile(keogram,99))
-    #print(f'Clipping at {clipValue}')
-    keogram=np.clip(keogram,0,clipValue) 
-    
-    # Create the plot
-    plt.figure(figsize=(12, 5))
-    
-    plt.imshow(keogram, aspect='auto', extent=[0, 24, lambda_min, lambda_max], origin='lower', cmap='viridis')
-    
-    # Set labels for the axes
-    plt.xlabel("Time (hours)")
-    ticks=np.arange(0,25,2)
-    tick_labels=[f"{int(t):02d}" for t in ticks]
-    plt.xticks(ticks,tick_labels)
-    
-    plt.ylabel("Wavelength (nm)")
-    plt.colorbar(label='Counts')
-    
-    plt.title(f'KHO/UNIS 1/2m White Ebert-Fastie spectrometer {fileyear}-{filemonth:02}-{fileday:02}')
-    
-    # Save the plot as a PNG file for the keogram website
-    plt.savefig(keofilename, dpi=100, bbox_inches='tight')
-    plt.close()
+    # Copy the scans to the keogram columns based on the time (rounded to
+    # the nearest full minute but limited to the current day). The dates of
+    # all scans are checked to be identical and valid. Don't care about
+    # overwriting any previous data, this is a summary plot...
+
+    builder=KeogramBuilder(filename, (fileyear,filemonth,fileday), {0:keogram.shape[0]})
+    builder.add_scans(itertools.chain([firstscan], scans))
+    plot_white_keogram(builder, keofilename)
+    return 'created'
 
 #------------------
 # - make a keogram from all white data
@@ -218,11 +147,23 @@ if __name__ == "__main__":
     #sourcepath=os.path.join('D:\\','KHO','saasdata','data25','White')
     sourcepath=os.path.join('E:\\','Incoming','saasdata','data26','White')
     destination=os.path.join('D:\\','KHO','saasdata','Keograms','White')
+
+    # The parsed files are cached here, so that re-rendering the keograms
+    # does not parse the text files again (set to None to disable)
+    cachedir=os.path.join('D:\\','KHO','saasdata','Cache','White')
+    
+    # Only process the files without a keogram. These are found from the
+    # first scan header of each file, so the rest are not parsed at all.
+    # Set to False to render all keograms again.
+    onlymissing=True
     
     files=glob.glob(os.path.join(sourcepath,'s??????2.lyr'))
+    if onlymissing:
+        files=missing_keograms(files,'white',destination,'White')
+        print(f'{len(files)} files without a keogram')
     
     for datafile in files:
         #datafile='s0101232.lyr'
         print(f'Processing {datafile}')
         filename=os.path.join('D:\\','KHO','Spectrometers','Software',datafile)
-        make_white_keogram(filename,destination)
\ No newline at end of file
+        make_white_keogram(filename,destination,overwrite=not onlymissing,cachedir=cachedir)
\ No newline at end of file
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+A persistent index of the data files in the KHO archives
+
+The batch scripts find their work by checking every possible
+year/month/day directory with isdir/glob, which is slow over network
+mounts. Instead, the files are catalogued into an SQLite database
+(instrument, timestamp, path, size and modification time) with a single
+os.scandir pass over the archive. On later refreshes only the directories
+whose modification time has changed are listed again, so a refresh of an
+unchanged archive only costs one stat per directory.
+
+Note that the modification time of a directory changes when files are
+added, removed or renamed, but not when an existing file is rewritten.
+
+Example:
+
+    index=ArchiveIndex('archive-index.sqlite')
+    index.refresh('u:\\\\')
+    for myday in index.missing_days('MISS','MISS-RGB'):
+        ...
+
+"""
+
+import datetime as dt
+import os
+import re
+import sqlite3
+
+#=================================================================
+# The instruments (and products) recognised from the file names. Each
+# pattern has one group, which is converted to the timestamp using the
+# given format.
+
+INSTRUMENTS={
+    'MISS': (r'MISS-(\d{8}-\d{6})\.pgm$', '%Y%m%d-%H%M%S'),
+    'MISS-RGB': (r'MISS-RGB-(\d{8})\.png$', '%Y%m%d'),
+    'MISS2': (r'MISS2-(\d{8}-\d{6})\.png$', '%Y%m%d-%H%M%S'),
+    'MISS2-RGB': (r'MISS2-RGB-(\d{8})\.png$', '%Y%m%d'),
+    'Sony': (r'LYR-Sony-(\d{8}_\d{6})\.jpg$', '%Y%m%d_%H%M%S'),
+    'Sony-DDMMYY': (r'LYR-Sony-(\d{6}_\d{6})\.jpg$', '%d%m%y_%H%M%S'),
+    'Sony-keogram': (r'LYR-Sony-(\d{8})\.jpg$', '%Y%m%d'),
+}
+
+_SCHEMA='''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    instrument TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_by_instrument ON files (instrument, timestamp);
+CREATE INDEX IF NOT EXISTS files_by_dir ON files (dir);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    subdirs TEXT NOT NULL
+);
+'''
+
+
+def classify(filename, instruments=INSTRUMENTS):
+    """
+    Returns (instrument, timestamp) for a file name, or None if the name
+    does not match any instrument or has an invalid date
+    """
+    for instrument, (pattern, timeformat) in instruments.items():
+        match=re.match(pattern, filename)
+        if match is None:
+            continue
+        try:
+            return instrument, dt.datetime.strptime(match.group(1), timeformat)
+        except ValueError:
+            return None
+    return None
+
+
+class ArchiveIndex:
+    """
+    SQLite catalogue of the data files under one or more archive roots
+    """
+
+    def __init__(self, dbfile, instruments=INSTRUMENTS):
+        self.instruments=instruments
+        self.db=sqlite3.connect(dbfile)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    #-------------------------------------------------------------
+    # Updating the index
+
+    def refresh(self, root):
+        """
+        Bring the index up to date with the files under root. Returns the
+        number of directories that had to be listed.
+        """
+        root=os.path.normpath(root)
+        seen=set()
+        rescanned=0
+        tovisit=[root]
+
+        with self.db:
+            while tovisit:
+                thisdir=tovisit.pop()
+                try:
+                    mtime_ns=os.stat(thisdir).st_mtime_ns
+                except OSError:
+                    continue
+                seen.add(thisdir)
+
+                row=self.db.execute('SELECT mtime_ns, subdirs FROM dirs WHERE path=?',
+                                    (thisdir,)).fetchone()
+                if row is not None and row[0]==mtime_ns:
+                    subdirs=row[1].split('\n') if row[1] else []
+                else:
+                    subdirs=self._scandir(root, thisdir, mtime_ns)
+                    rescanned+=1
+
+                tovisit.extend(os.path.join(thisdir,name) for name in subdirs)
+
+            # Forget the directories (and their files) that have disappeared
+            known=self.db.execute('SELECT path FROM dirs WHERE root=?', (root,)).fetchall()
+            for (thisdir,) in known:
+                if thisdir not in seen:
+                    self.db.execute('DELETE FROM files WHERE dir=?', (thisdir,))
+                    self.db.execute('DELETE FROM dirs WHERE path=?', (thisdir,))
+
+        return rescanned
+
+    def _scandir(self, root, thisdir, mtime_ns):
+        """
+        List one directory and replace its files in the index. Returns the
+        names of the subdirectories.
+        """
+        subdirs=[]
+        rows=[]
+        with os.scandir(thisdir) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                    continue
+                found=classify(entry.name, self.instruments)
+                if found is None:
+                    continue
+                instrument, timestamp=found
+                info=entry.stat()
+                rows.append((entry.path, thisdir, instrument,
+                             timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                             info.st_size, info.st_mtime))
+
+        self.db.execute('DELETE FROM files WHERE dir=?', (thisdir,))
+        self.db.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?)', rows)
+        self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?,?,?,?)',
+                        (thisdir, root, mtime_ns, '\n'.join(sorted(subdirs))))
+        return subdirs
+
+    #-------------------------------------------------------------
+    # Queries
+
+    def files(self, instrument, start=None, end=None):
+        """
+        Returns a list of (timestamp, path) for an instrument sorted by time,
+        optionally limited to start <= timestamp < end (datetimes or dates)
+        """
+        query='SELECT timestamp, path FROM files WHERE instrument=?'
+        params=[instrument]
+        if start is not None:
+            query+=' AND timestamp>=?'
+            params.append(_dbtime(start))
+        if end is not None:
+            query+=' AND timestamp<?'
+            params.append(_dbtime(end))
+        query+=' ORDER BY timestamp, path'
+        return [(dt.datetime.strptime(timestamp,'%Y-%m-%d %H:%M:%S'), path)
+                for timestamp, path in self.db.execute(query, params)]
+
+    def days(self, instrument):
+        """
+        Returns a sorted list of the days (dates) with files for an instrument
+        """
+        rows=self.db.execute('SELECT DISTINCT substr(timestamp,1,10) FROM files '
+                             'WHERE instrument=? ORDER BY 1', (instrument,))
+        return [dt.date.fromisoformat(day) for (day,) in rows]
+
+    def missing_days(self, instrument, product):
+        """
+        Returns a sorted list of the days with data from instrument, but
+        without any file of the product (e.g. a keogram)
+        """
+        rows=self.db.execute('SELECT substr(timestamp,1,10) FROM files WHERE instrument=? '
+                             'EXCEPT '
+                             'SELECT substr(timestamp,1,10) FROM files WHERE instrument=? '
+                             'ORDER BY 1', (instrument, product))
+        return [dt.date.fromisoformat(day) for (day,) in rows]
+
+
+def _dbtime(mytime):
+    if isinstance(mytime, dt.datetime):
+        return mytime.strftime('%Y-%m-%d %H:%M:%S')
+    return mytime.strftime('%Y-%m-%d 00:00:00')
@@ -0,0 +1,146 @@
+"""
+Run keogram backfills with one job per day or file on a pool of processes
+
+Each day is processed independently, so a reprocess of a whole season
+(for example, after a calibration change) scales with the number of cores.
+A failure on one day is recorded and reported at the end rather than
+stopping the whole run. If a worker process dies (out of memory, a crash
+in a C extension), the pool stops and the unfinished days are run again
+on a new pool, so only the day that kills its worker is reported as
+crashed. The same runner is used for the spectrometer keograms, with
+one file per job.
+
+"""
+
+import csv
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+
+def _runjob(jobfunc, job, retries=0, retrydelay=10):
+    """
+    Run one job and catch any errors so that they are reported rather
+    than lost in the worker process. Errors in reading or writing files
+    (OSError) are retried up to retries times after retrydelay seconds.
+    """
+    starttime=time.time()
+    for attempt in range(retries+1):
+        try:
+            status=jobfunc(*job)
+            if status is None:
+                status='done'
+            message='' if attempt==0 else f'succeeded after {attempt+1} attempts'
+            break
+        except OSError as error:
+            status='failed'
+            message=f'{error!r} (attempt {attempt+1} of {retries+1})\n{traceback.format_exc()}'
+            if attempt<retries:
+                time.sleep(retrydelay)
+        except Exception as error:
+            status='failed'
+            message=f'{error!r}\n{traceback.format_exc()}'
+            break
+    return job, status, message, time.time()-starttime
+
+
+def _runpool(jobfunc, jobs, workers, retries, results):
+    """
+    Run the jobs on one process pool and store their results. Returns the
+    jobs that were not finished because a worker process died, which
+    breaks the pool for all jobs still running or waiting.
+    """
+    unfinished=[]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures={pool.submit(_runjob, jobfunc, job, retries): job for job in jobs}
+        for future in as_completed(futures):
+            job=futures[future]
+            try:
+                results[job]=future.result()
+            except BrokenProcessPool:
+                unfinished.append(job)
+                continue
+            print(f'   -- {job}: {results[job][1]}')
+    return unfinished
+
+
+def run_backfill(jobfunc, jobs, workers=None, retries=0):
+    """
+    Call jobfunc(*job) for each job (e.g. a (year, month, day) tuple) and
+    return a list of (job, status, message, seconds) in the order of jobs.
+
+    The jobs are run on a process pool with the given number of workers
+    (None uses all cores). With workers=1 the jobs are run one at a time
+    in the calling process, which is handy for debugging. The job function
+    must be a module-level function (or a functools.partial of one) so that
+    it can be sent to the worker processes. A job that fails with an
+    OSError is tried again up to retries times.
+
+    If a worker process dies, the unfinished jobs are run again on a new
+    pool. A job that was unfinished in two broken pools is then run alone
+    in its own process, and if that process dies too, the job is reported
+    as 'crashed'.
+    """
+    jobs=list(jobs)
+    results={}
+    starttime=time.time()
+
+    if workers==1:
+        for job in jobs:
+            results[job]=_runjob(jobfunc, job, retries)
+    else:
+        pending=jobs
+        broken={}
+        while pending:
+            unfinished=_runpool(jobfunc, pending, workers, retries, results)
+            if len(unfinished)>0:
+                print(f'   -- A worker process died, {len(unfinished)} unfinished jobs are run again')
+            for job in unfinished:
+                broken[job]=broken.get(job,0)+1
+            pending=[job for job in unfinished if broken[job]<2]
+
+            # Run the jobs of repeatedly broken pools one at a time, so that
+            # the job that kills its worker does not take the others along
+            for job in unfinished:
+                if broken[job]<2:
+                    continue
+                if len(_runpool(jobfunc, [job], 1, retries, results))>0:
+                    results[job]=(job, 'crashed', 'The worker process died', 0.0)
+                    print(f'   -- {job}: crashed')
+
+    results=[results[job] for job in jobs]
+    print_summary(results, time.time()-starttime)
+    return results
+
+
+def print_summary(results, elapsed):
+    """
+    Print the number of jobs for each status and details of the failures
+    """
+    counts={}
+    for job, status, message, seconds in results:
+        counts[status]=counts.get(status,0)+1
+
+    print('======================================================')
+    print(f'Backfill of {len(results)} jobs finished in {elapsed:.1f} seconds')
+    for status, count in sorted(counts.items()):
+        print(f'   {status}: {count}')
+
+    for job, status, message, seconds in results:
+        if status in ('failed','crashed'):
+            print(f'{status.capitalize()} {job}:')
+            print(message)
+
+
+def write_results(results, filename):
+    """
+    Store the results of run_backfill as a CSV-file with one row per job
+    (the job, status, seconds and the first line of the message)
+    """
+    with open(filename,'w',newline='') as f:
+        writer=csv.writer(f)
+        writer.writerow(['job','status','seconds','message'])
+        for job, status, message, seconds in results:
+            writer.writerow([' '.join(str(item) for item in job), status, f'{seconds:.2f}',
+                             message.split('\n')[0]])
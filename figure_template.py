@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Reuse one Matplotlib figure for all keograms of a product
+
+Building a figure, its axes, tick locators, labels and colourbars takes
+much longer than drawing it, and in a long backfill the figures are built
+and torn down again for every day (or, if they are not closed, they pile
+up in memory). A FigureTemplate keeps the figure of a product and only
+replaces the image data, the image extents and the texts for each keogram
+before saving it. One template is kept in each process, so the memory use
+stays flat however many days are rendered.
+
+Example:
+
+    template=FigureTemplate(keogram_figure(np.zeros((180,24*60,3)), '0000-00-00'),
+                            '0000-00-00', dpi=100)
+    template.render(rgbkeo, 'MISS2-RGB-20250101.png', '2025-01-01')
+
+The render method is the same as in RasterKeogram (keogram_raster.py), so
+either can be given as the renderer of the keogram functions.
+
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.text import Text
+
+
+class FigureTemplate:
+    """
+    A keogram figure that is built once and filled with new data
+    """
+
+    def __init__(self, fig, *placeholders, relayout=False, **savekwargs):
+        """
+        fig          - the figure of the product drawn with placeholder data
+        placeholders - strings in the texts of the figure (e.g. the date in
+                       the title) that are replaced for each keogram
+        relayout     - run tight_layout again for each keogram, needed if
+                       the tick labels depend on the data
+        savekwargs   - arguments of savefig (dpi etc.)
+        """
+        self.fig=fig
+        self.placeholders=placeholders
+        self.relayout=relayout
+        self.savekwargs=savekwargs
+
+        # The images in the order of the axes of the figure
+        self.images=[image for ax in fig.axes for image in ax.get_images()]
+        self.texts=[(text, text.get_text()) for text in fig.findobj(Text)
+                    if any(p in text.get_text() for p in placeholders)]
+
+    def render(self, keograms, savefilename, *texts, extents=None, **savekwargs):
+        """
+        Replace the image data with keograms (an array, or a list of arrays
+        in the order of self.images), optionally their extents, and the
+        placeholders with texts. Then save the figure. Images with one
+        channel are scaled to the data range as in imshow.
+        """
+        if isinstance(keograms, np.ndarray):
+            keograms=[keograms]
+        for i, (image, keogram) in enumerate(zip(self.images, keograms)):
+            image.set_data(keogram)
+            if np.ndim(keogram)==2:
+                image.autoscale()
+            if extents is not None:
+                image.set_extent(extents[i])
+
+        for text, original in self.texts:
+            for placeholder, value in zip(self.placeholders, texts):
+                original=original.replace(placeholder, value)
+            text.set_text(original)
+
+        if self.relayout:
+            self.fig.tight_layout()
+        self.fig.savefig(savefilename, **{**self.savekwargs, **savekwargs})
+
+    def close(self):
+        plt.close(self.fig)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Fast rendering of keograms with a fixed layout
+
+The daily keograms are otherwise drawn by building a Matplotlib figure with
+its axes, ticks and labels, running tight_layout and saving it, once per
+day. For the products whose layout does not depend on the data, the figure
+is drawn only once here, with an empty keogram and a placeholder in the
+title. Each keogram is then
+
+    - converted to RGB bytes (through a colormap lookup table if it has
+      only one channel),
+    - resampled with PIL to the pixel area of the image in the figure and
+      pasted into a copy of the pre-rendered frame,
+    - given its own title by drawing the texts with the placeholder again
+      with PIL using the same font, and
+    - saved with PIL (png or jpg from the file name).
+
+The layout is identical to the Matplotlib figure. The pixels differ
+slightly, as the image is resampled with PIL and the title is drawn by
+FreeType in PIL instead of the Matplotlib text renderer.
+
+Example:
+
+    renderer=RasterKeogram(keogram_figure, (180,24*60,3), '0000-00-00')
+    renderer.render(rgbkeo, 'MISS2-RGB-20250101.png', '2025-01-01')
+
+"""
+
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+from matplotlib import font_manager, colors
+from matplotlib.text import Text
+from PIL import Image, ImageDraw, ImageFont
+
+
+class RasterKeogram:
+    """
+    Pre-rendered frame of a keogram figure that is filled with new data
+    """
+
+    def __init__(self, makefigure, shape, *placeholders, dpi=100):
+        """
+        makefigure   - function makefigure(image, *texts) that creates the
+                       Matplotlib figure of the product (one image on fixed
+                       axes) and returns the figure
+        shape        - shape of the keogram arrays, (rows, columns) or
+                       (rows, columns, 3)
+        placeholders - strings given as texts to makefigure, which are
+                       replaced by the texts of each day
+        dpi          - the resolution the figure would be saved with
+        """
+        self.shape=shape
+        self.placeholders=placeholders
+
+        fig=makefigure(np.zeros(shape), *placeholders)
+        try:
+            fig.set_dpi(dpi)
+            fig.canvas.draw()
+            self.dpi=dpi
+            self.frame=np.asarray(fig.canvas.buffer_rgba())[...,:3].copy()
+            self.facecolor=tuple(int(round(255*c)) for c in colors.to_rgb(fig.get_facecolor()))
+
+            images=[image for ax in fig.axes for image in ax.get_images()]
+            if len(images)!=1:
+                raise ValueError(f'Expected one image in the figure, found {len(images)}')
+            self._placeimage(images[0])
+            self._findtexts(fig)
+        finally:
+            plt.close(fig)
+
+    def _placeimage(self, image):
+        """
+        Find where the image is drawn in the frame: the pixel area and
+        whether it is flipped, clipped to the axes
+        """
+        height=self.frame.shape[0]
+        left, right, bottom, top=image.get_extent()
+        if image.origin=='upper':
+            top, bottom=bottom, top
+
+        # The display coordinates of the first and last edge of the rows
+        # and columns. The display y-axis points up, the frame rows down.
+        (x0, y0), (x1, y1)=image.axes.transData.transform([(left, bottom), (right, top)])
+        y0, y1=height-y0, height-y1
+        self.flipx=x1<x0
+        self.flipy=y1<y0
+        self.imagebox=[int(round(min(x0,x1))), int(round(min(y0,y1))),
+                       int(round(max(x0,x1))), int(round(max(y0,y1)))]
+
+        # Only the part inside the axes is visible
+        axbox=image.axes.bbox
+        self.clipbox=[max(self.imagebox[0], int(round(axbox.x0))),
+                      max(self.imagebox[1], int(round(height-axbox.y1))),
+                      min(self.imagebox[2], int(round(axbox.x1))),
+                      min(self.imagebox[3], int(round(height-axbox.y0)))]
+
+    def _findtexts(self, fig):
+        """
+        Find the texts with the placeholders and clear them from the frame
+        """
+        renderer=fig.canvas.get_renderer()
+        height=self.frame.shape[0]
+        self.texts=[]
+        for text in fig.findobj(Text):
+            if not text.get_visible() or not any(p in text.get_text() for p in self.placeholders):
+                continue
+            box=text.get_window_extent(renderer)
+            area=[int(np.floor(box.x0)), int(np.floor(height-box.y1)),
+                  int(np.ceil(box.x1)), int(np.ceil(height-box.y0))]
+            font=ImageFont.truetype(font_manager.findfont(text.get_fontproperties()),
+                                    round(text.get_fontsize()*self.dpi/72))
+            color=tuple(int(round(255*c)) for c in colors.to_rgb(text.get_color()))
+            self.texts.append((text.get_text(), area, font, color))
+            self.frame[area[1]:area[3],area[0]:area[2]]=self.facecolor
+
+    def rgb(self, keogram, cmap=None, vmin=None, vmax=None):
+        """
+        The keogram as uint8 RGB. A keogram with one channel is normalised
+        to vmin...vmax (the data range by default) and coloured with a
+        lookup table of the colormap, RGB keograms should be in 0...1.
+        """
+        keogram=np.asarray(keogram)
+        if keogram.ndim==3:
+            return (np.clip(keogram,0,1)*255).round().astype(np.uint8)
+
+        vmin=np.nanmin(keogram) if vmin is None else vmin
+        vmax=np.nanmax(keogram) if vmax is None else vmax
+        lut=(matplotlib.colormaps[cmap or 'viridis'](np.linspace(0,1,256))[:,:3]*255).round().astype(np.uint8)
+        scaled=(np.nan_to_num(keogram, nan=vmin)-vmin)/max(vmax-vmin, np.finfo(float).tiny)
+        return lut[(np.clip(scaled,0,1)*255).round().astype(np.intp)]
+
+    def render(self, keogram, savefilename, *texts, cmap=None, vmin=None, vmax=None, **savekwargs):
+        """
+        Draw the keogram into the frame, replace the placeholders with texts
+        and save the image (the format from the file name)
+        """
+        x0, y0, x1, y1=self.imagebox
+        image=Image.fromarray(self.rgb(keogram, cmap, vmin, vmax)).resize((x1-x0, y1-y0),
+                                                                           Image.Resampling.BILINEAR)
+        if self.flipx:
+            image=image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        if self.flipy:
+            image=image.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+
+        c0, r0, c1, r1=self.clipbox
+        picture=Image.fromarray(self.frame)
+        picture.paste(image.crop((c0-x0, r0-y0, c1-x0, r1-y0)), (c0, r0))
+
+        draw=ImageDraw.Draw(picture)
+        for text, area, font, color in self.texts:
+            for placeholder, value in zip(self.placeholders, texts):
+                text=text.replace(placeholder, value)
+            draw.text(((area[0]+area[2])/2, (area[1]+area[3])/2), text, fill=color, font=font, anchor='mm')
+
+        picture.save(savefilename, **savekwargs)
+        return picture